@@ -0,0 +1,222 @@
+import os
+import numpy as np
+
+
+def referencedTemplates(templates, width=None):
+    """
+    Reference each template to the line joining its first and last samples,
+    so the subtracted wave starts and ends at zero and the channel's baseline
+    is left untouched, and zero-pad them to a common width so that channels
+    with different template lengths can be fit together.
+    :param templates: list of template waves (one per channel)
+    :param width: common width (default: the longest template)
+    :return: ndarray templates (channels x width), ndarray support mask
+    """
+    if width is None:
+        width = max(len(t) for t in templates)
+    out = np.zeros((len(templates), width), dtype=np.float64)
+    support = np.zeros((len(templates), width), dtype=bool)
+    for ix, template in enumerate(templates):
+        template = np.asarray(template, dtype=np.float64)[:width]
+        out[ix, :len(template)] = template - np.linspace(template[0], template[-1], len(template))
+        support[ix, :len(template)] = True
+    return out, support
+
+
+def consensusTemplate(templates):
+    """
+    Combine the channel templates into one shape by averaging the z-normalized
+    templates (truncated to the shortest one)
+    :param templates: list of template waves
+    :return: ndarray consensus template
+    """
+    width = min(len(t) for t in templates)
+    normed = []
+    for template in templates:
+        template = np.asarray(template[:width], dtype=np.float64)
+        std = np.std(template)
+        normed.append((template - np.mean(template)) / (std if std > 0 else 1))
+    return np.mean(normed, axis=0)
+
+
+def mergeEvents(startsList, width):
+    """
+    Merge the event starts detected on several channels into one list of
+    shared events; starts closer than half a template width are treated as
+    the same event and replaced by their median.
+    :param startsList: list of event start index lists (one per channel)
+    :param width: template width in samples
+    :return: ndarray of merged event starts
+    """
+    starts = np.sort(np.concatenate([np.asarray(s, dtype=np.int64) for s in startsList]
+                                    + [np.zeros(0, dtype=np.int64)]))
+    if len(starts) == 0:
+        return starts
+    groups = np.split(starts, np.where(np.diff(starts) >= width // 2)[0] + 1)
+    return np.array([int(np.median(g)) for g in groups], dtype=np.int64)
+
+
+def subtractTemplates(chunk, templates, support, eventStarts, eventMask):
+    """
+    Fit and subtract a scaled template at every event on every channel of a
+    chunk, vectorized over events and channels.
+    :param chunk: channels x samples data (modified in place)
+    :param templates: referenced templates (channels x width)
+    :param support: channels x width booleans of each template's samples
+    :param eventStarts: event start indices within the chunk (events)
+    :param eventMask: events x channels booleans of where to subtract
+    :return: events x channels fitted scales
+    """
+    width = templates.shape[1]
+    if len(eventStarts) == 0:
+        return np.zeros((0, chunk.shape[0]))
+    windows = eventStarts[:, None] + np.arange(width)  # events x width
+    segments = chunk[:, windows].transpose(1, 0, 2)  # events x channels x width
+    # least squares fit of scale * template + offset over the template's samples
+    counts = np.maximum(support.sum(axis=1), 1)
+    centered = (templates - (templates.sum(axis=1) / counts)[:, None]) * support
+    energy = np.einsum('cw,cw->c', centered, centered)
+    energy[energy == 0] = 1
+    scales = np.einsum('ecw,cw->ec', segments, centered) / energy
+    scales[~eventMask] = 0
+    fitted = scales.T[:, :, None] * templates[:, None, :]  # channels x events x width
+    # unbuffered so that overlapping windows each subtract their own fit
+    np.subtract.at(chunk, (np.arange(chunk.shape[0])[:, None, None], windows[None, :, :]),
+                   fitted.astype(chunk.dtype, copy=False))
+    return scales
+
+
+def chunkBoundaries(eventStarts, width, sampleCount, chunkSamples):
+    """
+    Split the recording into chunks of about chunkSamples samples without
+    cutting through any event window.
+    :param eventStarts: sorted event start indices
+    :param width: template width in samples
+    :param sampleCount: number of samples in the recording
+    :param chunkSamples: target chunk length
+    :return: list of (start, stop) sample ranges
+    """
+    eventStarts = np.asarray(eventStarts, dtype=np.int64)
+    eventEnds = eventStarts + width
+    bounds = []
+    start = 0
+    while start < sampleCount:
+        stop = min(start + chunkSamples, sampleCount)
+        # pull the end back to the earliest event it cuts; that new end may cut
+        # an earlier (overlapping) event, so repeat until nothing is cut
+        while True:
+            cut = (eventStarts > start) & (eventStarts < stop) & (eventEnds > stop)
+            if not cut.any():
+                break
+            stop = int(eventStarts[cut].min())
+        # an event starting at the chunk start and running past the end (chunk
+        # shorter than the events) pushes the end forward instead
+        while stop < sampleCount:
+            cut = (eventStarts < stop) & (eventEnds > stop)
+            if not cut.any():
+                break
+            stop = min(int(eventEnds[cut].max()), sampleCount)
+        bounds.append((start, stop))
+        start = stop
+    return bounds
+
+
+def _readChunk(source, start, stop, dtype):
+    # an mne Raw object reads the chunk from disk; arrays are sliced
+    if hasattr(source, 'get_data'):
+        return source.get_data(start=start, stop=stop).astype(dtype, copy=False)
+    return np.array(source[:, start:stop], dtype=dtype)
+
+
+def _cleanedRaw(npyName, info):
+    # a lazily read mne Raw over the cleaned .npy, so that saving it as FIF
+    # reads (and writes) one buffer at a time instead of the whole recording
+    from mne.io import BaseRaw
+
+    class CleanedRaw(BaseRaw):
+        def _read_segment_file(self, data, idx, fi, start, stop, cals, mult):
+            values = np.load(self._raw_extras[fi]['npyName'], mmap_mode='r')
+            if mult is None:
+                data[:] = values[idx, start:stop]
+            else:
+                # mult expects uncalibrated values; the .npy holds calibrated ones
+                data[:] = mult @ (values[idx, start:stop] / self._cals[idx, None])
+
+    sampleCount = np.load(npyName, mmap_mode='r').shape[1]
+    return CleanedRaw(info, last_samps=[sampleCount - 1], filenames=[npyName],
+                      raw_extras=[{'npyName': npyName}])
+
+
+def cleanRecording(source, templates, eventStarts, fName, channelIndecies,
+                   mode='CHANNEL', sampleRate=1000, chunkSeconds=60,
+                   dtype=np.float64, info=None):
+    """
+    Remove detected events from a recording by template subtraction, one
+    chunk of samples at a time, writing the cleaned recording to a
+    memory-mapped .npy file (and, for a .fif name, saving it as FIF one
+    buffer at a time).
+    :param source: mne Raw (read lazily with get_data) or channels x samples array
+    :param templates: list of template waves, one per channel in channelIndecies
+    :param eventStarts: list of absolute event start indices per channel in
+    channelIndecies (a shared list appears once per channel)
+    :param fName: output file name (.npy or .fif)
+    :param channelIndecies: channels the templates and events belong to
+    :param mode: 'CHANNEL' subtracts each channel's own template at its own
+    events; 'CONSENSUS' regresses the consensus template out of every channel
+    of the recording at the merged events
+    :param sampleRate: samples per second
+    :param chunkSeconds: length of the chunks processed at a time
+    :param dtype: dtype of the cleaned data
+    :param info: mne Info used when writing FIF (default: source.info; required
+    when source is an array)
+    :return: number of events removed
+    """
+    if fName.endswith('.fif') and info is None:
+        if not hasattr(source, 'info'):
+            raise ValueError("Saving an array as FIF needs the mne Info of the "
+                             "recording (info=...)")
+        info = source.info
+    if hasattr(source, 'get_data'):
+        channelCount, sampleCount = len(source.ch_names), source.n_times
+    else:
+        channelCount, sampleCount = source.shape
+    if mode == 'CONSENSUS':
+        consensus, consensusSupport = referencedTemplates([consensusTemplate(templates)])
+        width = consensus.shape[1]
+        chanTemplates = np.tile(consensus, (channelCount, 1))
+        support = np.tile(consensusSupport, (channelCount, 1))
+        events = mergeEvents(eventStarts, width)
+        eventMask = np.ones((len(events), channelCount), dtype=bool)
+    else:
+        width = max(len(t) for t in templates)
+        chanTemplates = np.zeros((channelCount, width))
+        support = np.zeros((channelCount, width), dtype=bool)
+        chanTemplates[channelIndecies], support[channelIndecies] = referencedTemplates(templates, width)
+        events = np.unique(np.concatenate([np.asarray(s, dtype=np.int64) for s in eventStarts]
+                                          + [np.zeros(0, dtype=np.int64)]))
+        eventMask = np.zeros((len(events), channelCount), dtype=bool)
+        for cIX, electIX in enumerate(channelIndecies):
+            eventMask[np.searchsorted(events, eventStarts[cIX]), electIX] = True
+    # windows running off the end of the recording are left as they are
+    inRange = events + width <= sampleCount
+    events, eventMask = events[inRange], eventMask[inRange]
+
+    npyName = fName if fName.endswith('.npy') else os.path.splitext(fName)[0] + '.npy'
+    cleaned = np.lib.format.open_memmap(npyName, mode='w+', dtype=dtype,
+                                        shape=(channelCount, sampleCount))
+    for start, stop in chunkBoundaries(events, width, sampleCount,
+                                       int(chunkSeconds * sampleRate)):
+        chunk = _readChunk(source, start, stop, dtype)
+        inChunk = (events >= start) & (events < stop)
+        subtractTemplates(chunk, chanTemplates, support, events[inChunk] - start,
+                          eventMask[inChunk])
+        cleaned[:, start:stop] = chunk
+        cleaned.flush()
+    del cleaned
+    print(f"Removed {len(events)} events ({mode}) from {channelCount} channels; "
+          f"cleaned data written to {npyName}")
+
+    if fName.endswith('.fif'):
+        _cleanedRaw(npyName, info).save(fName, overwrite=True)
+        print(f"Cleaned recording saved to {fName}")
+    return len(events)
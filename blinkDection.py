@@ -1,13 +1,10 @@
+import os
+import itertools
 import stumpy
 import numpy as np
 
-import matplotlib.pyplot as plt
-from matplotlib.patches import Rectangle
-import matplotlib.cm as cm
-from matplotlib import colors
-
-from mne.channels import make_standard_montage
-from mne.viz import plot_sensors
+# matplotlib and mne's channel/viz modules are slow to import and only needed
+# once a figure is drawn, so the plotting functions import them on first use.
 COLOR_LIST = ['tab:blue', 'tab:orange', 'tab:green', 'tab:red', 'tab:purple',
 'tab:brown', 'tab:pink', 'tab:gray', 'tab:olive', 'tab:cyan']
 MAX_REAL = 0.01  # threshold value for determining a channel value is invalid
@@ -20,6 +17,7 @@ def plotEEGs(eegData, tLabels, eLabels):
     :param eLabels: list of electrode label strings
     :return:
     """
+    import matplotlib.pyplot as plt
     base = 0.0
     offset = -0.0003
     for ix in range(len(eLabels)):
@@ -40,6 +38,51 @@ def plotEEGs(eegData, tLabels, eLabels):
     return
 
 
+def axisPixels(ax):
+    """
+    :param ax: matplotlib axes
+    :return: the width of the axes on screen in pixels
+    """
+    return max(int(ax.get_window_extent().width), 1)
+
+def envelope(xData, yData, nBins):
+    """
+    Reduce a trace to the minimum and maximum of each of nBins bins so that a
+    long recording is drawn with a fixed number of points that still shows
+    every peak at screen resolution.
+    :param xData: x values (e.g., time labels)
+    :param yData: y values
+    :param nBins: number of bins (e.g., axis width in pixels)
+    :return: x values, y values (2 points per bin)
+    """
+    xData = np.asarray(xData)
+    yData = np.asarray(yData)
+    count = min(len(xData), len(yData))
+    if count <= 2 * nBins:
+        return xData[:count], yData[:count]
+    binSize = int(np.ceil(count / nBins))
+    pad = (-count) % binSize
+    blocks = np.concatenate([yData[:count], np.full(pad, yData[count-1])]).reshape(-1, binSize)
+    xs = np.repeat(xData[:count:binSize], 2)
+    ys = np.column_stack([np.min(blocks, axis=1), np.max(blocks, axis=1)]).ravel()
+    return xs, ys
+
+def drawEventSpans(ax, starts, width, yMin, height, facecolors):
+    """
+    Draw every event of an axis as one broken_barh collection instead of one
+    Rectangle patch per event.
+    :param ax: matplotlib axes
+    :param starts: event start x values
+    :param width: event width in x units
+    :param yMin: bottom of the spans
+    :param height: height of the spans
+    :param facecolors: a color or one color per event
+    :return: the collection added
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    xRanges = np.column_stack([starts, np.full(len(starts), width, dtype=np.float64)])
+    return ax.broken_barh(xRanges, (yMin, height), facecolors=facecolors)
+
 def plotMotifDiscovery(timeLabels, vData, distData, targetIX, matchIX, wwidth,
                        title='Motif (Pattern) Discovery'):
     """
@@ -55,23 +98,24 @@ def plotMotifDiscovery(timeLabels, vData, distData, targetIX, matchIX, wwidth,
     :param title:
     :return:
     """
-    vMax = max(vData)
-    vMin = min(vData)
+    import matplotlib.pyplot as plt
+    vData = np.asarray(vData)
+    vMax = np.max(vData)
+    vMin = np.min(vData)
     height = vMax - vMin
     fig, axs = plt.subplots(2, sharex=True, gridspec_kw={'hspace': 0})
     plt.suptitle(title, fontsize='14')
-    axs[0].plot(timeLabels, vData)
+    pixels = axisPixels(axs[0])
+    axs[0].plot(*envelope(timeLabels[:len(vData)], vData, pixels))
     axs[0].set_ylabel('EEG', fontsize='14')
-    rect0 = Rectangle((timeLabels[targetIX], vMin), wwidth, height=height-10, facecolor='lightgrey')
-    axs[0].add_patch(rect0)
-    rect1 = Rectangle((timeLabels[matchIX], vMin), wwidth, height=height, facecolor='orange')
-    axs[0].add_patch(rect1)
+    drawEventSpans(axs[0], [timeLabels[targetIX]], wwidth, vMin, height-10, 'lightgrey')
+    drawEventSpans(axs[0], [timeLabels[matchIX]], wwidth, vMin, height, 'orange')
     axs[1].set_xlabel('Time', fontsize='14')
     axs[1].set_ylabel('Matrix Profile', fontsize='14')
     axs[1].axvline(x=timeLabels[targetIX], linestyle="dashed")
     axs[1].axvline(x=timeLabels[matchIX], linestyle="dotted")
     axs[1].tick_params(labelbottom=True)
-    axs[1].plot(timeLabels[:len(distData)], distData)
+    axs[1].plot(*envelope(timeLabels[:len(distData)], distData, pixels))
     plt.show()
 
     return
@@ -79,6 +123,8 @@ def plotMotifDiscovery(timeLabels, vData, distData, targetIX, matchIX, wwidth,
 def plotMotifMatch(vData, targetIX, matchIX, wwidth, dist):
     # plot a window that includes the two matched patterns with 2x window size border
     # and the two matched waveforms on top of one another
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Rectangle
     vMax = max(vData)
     vMin = min(vData)
     height = vMax - vMin
@@ -106,6 +152,8 @@ def plotMotifMatch(vData, targetIX, matchIX, wwidth, dist):
 def plotMotifMatches(vData, indecies, wwidth, title=None):
     # plot a window that includes the two matched patterns with 2x window size border
     # and the two matched waveforms on top of one another
+    import matplotlib.pyplot as plt
+    from matplotlib.patches import Rectangle
 
     vMax = max(vData)
     vMin = min(vData)
@@ -186,7 +234,11 @@ def plotSynchedMeanWaves(vData, tLabels, indecies, wwidth,
     :param electrodes: electrode labels
     :return: None
     """
-    commonStarts, commonPreWidth, commonWwidth = expandVizWindow(indecies, wwidth, electrodes)
+    if all(list(ix) == list(indecies[0]) for ix in indecies):
+        # consensus detection already gives every electrode the same events
+        commonStarts, commonPreWidth, commonWwidth = indecies[0], 0, wwidth
+    else:
+        commonStarts, commonPreWidth, commonWwidth = expandVizWindow(indecies, wwidth, electrodes)
     eleCount = len(indecies)
 
     # Identify common windows for each blink
@@ -264,31 +316,31 @@ def plotMotifMatchesMultiElectrodes(vData, tLabels, indecies, wwidth,
                                     title=None, electrodes=None):
     # plot a window that includes the two matched patterns with 2x window size border
     # and the two matched waveforms on top of one another
+    import matplotlib.pyplot as plt
 
     eleCount = len(indecies)
-    fig, axs = plt.subplots(eleCount)
+    fig, axs = plt.subplots(eleCount, squeeze=False)
+    axs = axs[:, 0]
     if title is None:
         title = f"All {eleCount} electrodes All waves"
     plt.suptitle(title, fontsize='14')
+    pixels = axisPixels(axs[0])
+    spanColors = COLOR_LIST[1:]
 
     # find series min and max across all electrodes
-    sMin = max(0, min(ix - (2 * wwidth) for ix in indecies[0]))
-    sMax = min(len(vData[0]), max(ix + (3 * wwidth) for ix in indecies[0]))
-    for eIX in range(1, eleCount):
-        if sMin > max(0, min(ix - (2 * wwidth) for ix in indecies[eIX])):
-            sMin = max(0, min(ix - (2 * wwidth) for ix in indecies[eIX]))
-        if sMax < min(len(vData[eIX]), max(ix + (3 * wwidth) for ix in indecies[eIX])):
-            sMax = min(len(vData[eIX]), max(ix + (3 * wwidth) for ix in indecies[eIX]))
+    allIndecies = np.concatenate([np.asarray(ix, dtype=np.int64) for ix in indecies])
+    sMin = max(0, int(np.min(allIndecies)) - (2 * wwidth))
+    sMax = min(max(len(v) for v in vData), int(np.max(allIndecies)) + (3 * wwidth))
     for eIX in range(eleCount):
-        vMax = max(vData[eIX])
-        vMin = min(vData[eIX])
+        trace = np.asarray(vData[eIX])
+        vMax = np.max(trace)
+        vMin = np.min(trace)
         height = vMax - vMin
-        axs[eIX].plot(tLabels[sMin:sMax], vData[eIX][sMin:sMax], color=COLOR_LIST[0],
-                      label=electrodes[eIX])
-        for ix, _index in enumerate(indecies[eIX]):
-            rect = Rectangle((tLabels[_index-sMin], vMin), max(.1, wwidth/1000), height=height,
-                              facecolor=COLOR_LIST[1 + (ix % (len(COLOR_LIST)-1))])
-            axs[eIX].add_patch(rect)
+        axs[eIX].plot(*envelope(tLabels[sMin:sMax], trace[sMin:sMax], pixels),
+                      color=COLOR_LIST[0], label=electrodes[eIX])
+        starts = tLabels[np.asarray(indecies[eIX], dtype=np.int64) - sMin]
+        drawEventSpans(axs[eIX], starts, max(.1, wwidth/1000), vMin, height,
+                       [spanColors[ix % len(spanColors)] for ix in range(len(starts))])
         axs[eIX].legend(loc='upper right')
         if eIX > eleCount - 2 or eleCount == 1:
             axs[eIX].tick_params(labelbottom=True)
@@ -301,6 +353,7 @@ def plotMotifMatchesMultiElectrodes(vData, tLabels, indecies, wwidth,
 def plotWaves(waves, xLabels=[], labels=[], zNorm=True, title="Wave Plot"):
     # plot a window that includes the two matched patterns with 2x window size border
     # and the two matched waveforms on top of one another
+    import matplotlib.pyplot as plt
     if zNorm and title == '':
         title = f"{title} normed"
     for ix, waveO in enumerate(waves):
@@ -319,14 +372,49 @@ def plotWaves(waves, xLabels=[], labels=[], zNorm=True, title="Wave Plot"):
     plt.show()
     return
 
+def asFloat64(vData):
+    """
+    stumpy only accepts float64 data, so float32 channels are widened one at a
+    time as they are handed to it (float64 data is passed through uncopied)
+    :param vData: time series data
+    :return: float64 ndarray
+    """
+    return np.asarray(vData, dtype=np.float64)
+
 def combineWaves(waves, weights=[]):
     if weights == []:
         weights = [1/len(waves)]* len(waves)
-    waveProduct = np.sum([waves[ix] * weights[ix] for ix in range(len(waves))], axis=0)
-    return waveProduct
+    # accumulate in float64 and return the precision the waves came in
+    dtype = np.result_type(np.asarray(waves[0]).dtype, np.float32)
+    waveProduct = np.sum([np.asarray(waves[ix], dtype=np.float64) * weights[ix]
+                          for ix in range(len(waves))], axis=0)
+    return waveProduct.astype(dtype, copy=False)
+
+def slidingStats(vData, m):
+    """
+    Compute the sliding mean, standard deviation and constant-subsequence
+    flags of every length m subsequence of the data.  These only depend on the
+    data and the template length, so they can be computed once and passed to
+    findBlinks for any number of templates/thresholds of that length.
+    :param vData: time series data
+    :param m: subsequence (template) length in samples
+    :return: (mean, std, isconstant) arrays
+    """
+    T = asFloat64(vData)
+    meanT, stdT = stumpy.core.compute_mean_std(T, m)
+    return meanT, stdT, stumpy.core.process_isconstant(T, m, None)
+
+def matrixProfile(vData, m):
+    """
+    Self-join matrix profile of the data (see stumpy.stump)
+    :param vData: time series data
+    :param m: subsequence (template) length in samples
+    :return: matrix profile (n-m+1 x 4)
+    """
+    return stumpy.stump(asFloat64(vData), m=m)
 
 def findBlinkWave(vData, blinkDuration, sampleHz=1000, tLabels=[],
-                  verbose=10, electrode=None):
+                  verbose=10, electrode=None, matrixProf=None):
     """
     Return a wave profile that is a combination of two well-matched waves in the
     sequence.
@@ -334,6 +422,7 @@ def findBlinkWave(vData, blinkDuration, sampleHz=1000, tLabels=[],
     :param blinkDuration: expected blink duration in seconds
     :param sampleHz: the number of samples per second in the data provided
     :param verbose: how verbose (0-10) output should be
+    :param matrixProf: precomputed matrixProfile(vData, window size)
     :return: ndarray containing wave profile
     """
     convolve = True
@@ -341,7 +430,9 @@ def findBlinkWave(vData, blinkDuration, sampleHz=1000, tLabels=[],
     if verbose > 2:
         print(f"Looking across {len(vData)/sampleHz}s sampled at {sampleHz}Hz "
               f"({len(vData)} points) for electrode {electrode} with a window of {blinkDuration}s ({window_size} points)")
-    matrix_profile = stumpy.stump(vData, m=window_size)
+    if matrixProf is None:
+        matrixProf = matrixProfile(vData, window_size)
+    matrix_profile = matrixProf
     mp = matrix_profile
     motif_idx = np.argsort(mp[:, 0])[0]
     if verbose > 2:
@@ -407,38 +498,239 @@ def findBlinkWave(vData, blinkDuration, sampleHz=1000, tLabels=[],
                       title="Waves found normed")
     return blinkWave
 
-def findBlinks(initWave, vData, blinkDuration, sampleHz=1000,
-                      tLabels=[], verbose=10, electrode=None):
+def abJoin(joinArgs):
     """
-    Return a list of the start time of a blink
-    in seconds and a list of associated wave dissimilarities
-    :param vData: time series data
+    AB-join matrix profile: for every subsequence of T_A the distance to, and
+    index of, its nearest neighbor in T_B
+    :param joinArgs: (T_A, m, T_B)
+    :return: ndarray distances, ndarray neighbor indices
+    """
+    T_A, m, T_B = joinArgs
+    mp = stumpy.stump(asFloat64(T_A), m, asFloat64(T_B), ignore_trivial=False)
+    return mp[:, 0].astype(np.float64), mp[:, 1].astype(np.int64)
+
+def abJoinPair(joinArgs):
+    """
+    AB-join a pair of windows in both directions.  stump only reports the
+    nearest neighbors of T_A's subsequences, so each direction is a join.
+    :param joinArgs: (T_A, m, T_B)
+    :return: abJoin result for T_A against T_B, abJoin result for T_B against T_A
+    """
+    T_A, m, T_B = joinArgs
+    return abJoin((T_A, m, T_B)), abJoin((T_B, m, T_A))
+
+def _initJoinWorker(cacheDir):
+    # a spawned worker starts without the parent's kernel cache settings
+    if cacheDir:
+        from jitCache import enableKernelCache
+        enableKernelCache(cacheDir)
+
+def findBlinkWaveMultiWindow(windows, blinkDuration, sampleHz=1000,
+                             verbose=10, electrode=None, disThresh=10,
+                             workers=1):
+    """
+    Return a wave profile for the motif that recurs in the most of several
+    disjoint windows.  Every pair of windows is AB-joined (once per
+    direction, in one task), so the cost grows with the number of window
+    pairs rather than with the span the windows cover.  Each subsequence is
+    ranked first by the number of other windows holding a match closer than
+    disThresh and then by its mean distance to them, and the best one is
+    combined with its matches.
+    :param windows: list of time series data windows
     :param blinkDuration: expected blink duration in seconds
     :param sampleHz: the number of samples per second in the data provided
     :param verbose: how verbose (0-10) output should be
-    :return: [blink_start_seconds, ...], [blink dissimilarity, ...]
+    :param electrode: electrode label
+    :param disThresh: dissimilarity threshold for a match in another window
+    :param workers: number of processes used for the AB-joins
+    :return: ndarray containing wave profile, [(window, start index), ...] of
+    the subsequences combined into it
     """
     window_size = int(blinkDuration * sampleHz)  # data points found in a pattern
+    windows = [np.asarray(w, dtype=np.float64) for w in windows]
+    if len(windows) < 2 or min(len(w) for w in windows) <= window_size:
+        raise ValueError(f"At least two windows, each longer than {blinkDuration}s, "
+                         f"are needed to learn across windows")
+    pairs = list(itertools.combinations(range(len(windows)), 2))
     if verbose > 2:
-        print(f"Looking across {len(vData) / sampleHz}s sampled at {sampleHz}Hz ({len(vData)} points) with a window of {blinkDuration}s ({window_size} points)")
-    distance_profile = stumpy.mass(initWave, vData)
-    if verbose > 9:
-        plt.plot(tLabels[:len(distance_profile)],
-                 distance_profile,
-                 label="Dissimilarity from target wave")
-        plt.title(f'Distance Profile E {electrode}')
-        plt.show()
+        print(f"AB-joining {len(pairs)} window pairs of {len(windows)} windows for "
+              f"electrode {electrode} with a window of {blinkDuration}s ({window_size} points)")
+    joinArgs = [(windows[a], window_size, windows[b]) for a, b in pairs]
+    if workers > 1:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # forking after numba's parallel kernels have run leaves the
+        # workers' threading layer in a state that hangs at exit
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_initJoinWorker,
+                                 initargs=(os.environ.get('NUMBA_CACHE_DIR'),)) as pool:
+            pairJoins = list(pool.map(abJoinPair, joinArgs))
+    else:
+        pairJoins = list(map(abJoinPair, joinArgs))
+    joins = {}
+    for (a, b), (joinAB, joinBA) in zip(pairs, pairJoins):
+        joins[(a, b)], joins[(b, a)] = joinAB, joinBA
+
+    scores = []
+    for a in range(len(windows)):
+        dists = np.vstack([joins[(a, b)][0] for b in range(len(windows)) if b != a])
+        scores.append((np.sum(dists < disThresh, axis=0), np.mean(dists, axis=0)))
+    mostWindows = max(int(support.max()) for support, _ in scores)
+    best = None
+    for a, (support, meanDist) in enumerate(scores):
+        # as in findBlinkWave, centre the motif on the lowest region of the
+        # profile rather than on its single lowest point, among the
+        # subsequences recurring in the most windows
+        smoothed = np.convolve(np.ones(window_size) / window_size, meanDist, mode='valid')
+        centers = np.arange(len(smoothed)) + int(window_size/2)
+        smoothed[support[centers] < mostWindows] = np.inf
+        if best is None or smoothed.min() < best[0]:
+            best = (smoothed.min(), a, int(centers[np.argmin(smoothed)]))
+    if not np.isfinite(best[0]):
+        # the best-supported subsequences sit at a window's edge, outside the
+        # smoothed range, so take the closest of them unsmoothed
+        best = min((meanDist[ix], a, int(ix)) for a, (support, meanDist) in enumerate(scores)
+                   for ix in np.flatnonzero(support == mostWindows))
+    _, motifWindow, motif_idx = best
+    support = mostWindows
+    members = [(motifWindow, motif_idx)]
+    matches = [(joins[(motifWindow, b)][0][motif_idx], b, int(joins[(motifWindow, b)][1][motif_idx]))
+               for b in range(len(windows)) if b != motifWindow]
+    members.extend((b, ix) for dist, b, ix in matches if dist < disThresh)
+    if len(members) == 1:
+        # no window holds a close match, so fall back to the nearest neighbor
+        _, b, ix = min(matches)
+        members.append((b, ix))
+    if verbose > 2:
+        print(f"The motif is located at index {motif_idx} of window {motifWindow} "
+              f"and recurs in {support} of {len(windows) - 1} other windows")
+    blinkWave = combineWaves([windows[w][ix:ix + window_size] for w, ix in members])
+    return blinkWave, members
+
+def massProfile(initWave, vData, tStats=None, minScale=0.5):
+    """
+    z-normalized Euclidean distance of the template to every subsequence
+    :param initWave: template wave
+    :param vData: time series data
+    :param tStats: precomputed slidingStats(vData, len(initWave))
+    :param minScale: unused (see matchedFilterProfile)
+    :return: ndarray distance profile
+    """
+    if tStats is None:
+        return stumpy.mass(asFloat64(initWave), asFloat64(vData))
+    return stumpy.mass(asFloat64(initWave), asFloat64(vData),
+                       M_T=tStats[0], Σ_T=tStats[1], T_subseq_isconstant=tStats[2])
+
+def matchedFilterScale(initWave, vData):
+    """
+    Least squares scale of the (mean removed) template at every offset from
+    one overlap-add FFT cross-correlation; no sliding statistics are needed.
+    :param initWave: template wave
+    :param vData: time series data
+    :return: ndarray of scales (1 is an event as large as the template)
+    """
+    from scipy.signal import oaconvolve
+    template = asFloat64(initWave)
+    template = template - np.mean(template)
+    energy = np.dot(template, template)
+    if energy == 0:
+        return np.zeros(len(vData) - len(template) + 1)
+    return oaconvolve(asFloat64(vData), template[::-1], mode='valid') / energy
+
+def matchedFilterProfile(initWave, vData, tStats=None, minScale=0.5):
+    """
+    Matched filter score in distance profile form: 1 / (1 + scale), which
+    is non-negative like a distance, 1 where the template does not fit
+    (scale <= 0) and falls towards 0 as the scale grows, so events are kept
+    where the scale reaches minScale.  Unlike MASS the score falls with
+    amplitude, so low-amplitude noise that happens to share the template's
+    shape is gated out.
+    :param initWave: template wave
+    :param vData: time series data
+    :param tStats: unused (see massProfile)
+    :param minScale: smallest template scale accepted (see engineThreshold)
+    :return: ndarray profile
+    """
+    return 1 / (1 + np.maximum(matchedFilterScale(initWave, vData), 0))
 
+def hybridProfile(initWave, vData, tStats=None, minScale=0.5):
+    """
+    Screen with the matched filter and confirm with MASS: the z-normalized
+    distance is computed only where the template scale reaches minScale and
+    every other offset is left at infinity.  The sliding statistics come from
+    cumulative sums, evaluated at the candidates only.
+    :param initWave: template wave
+    :param vData: time series data
+    :param tStats: unused (see massProfile)
+    :param minScale: smallest template scale screened in
+    :return: ndarray distance profile
+    """
+    template = asFloat64(initWave)
+    m = len(template)
+    scale = matchedFilterScale(template, vData)
+    profile = np.full(len(scale), np.inf)
+    candidates = np.flatnonzero(scale >= minScale)
+    tStd = np.std(template)
+    if len(candidates) == 0 or tStd == 0:
+        return profile
+    series = asFloat64(vData)
+    series = series - np.mean(series)
+    sums = np.concatenate([[0.0], np.cumsum(series)])
+    squares = np.concatenate([[0.0], np.cumsum(series * series)])
+    mean = (sums[candidates + m] - sums[candidates]) / m
+    var = (squares[candidates + m] - squares[candidates]) / m - mean * mean
+    std = np.sqrt(np.maximum(var, 0))
+    # sum((x - mean) * (t - tMean)) is scale * energy = scale * m * tStd**2
+    corr = np.divide(scale[candidates] * tStd, std, out=np.zeros(len(candidates)),
+                     where=std > 0)
+    profile[candidates] = np.sqrt(np.maximum(2 * m * (1 - np.minimum(corr, 1)), 0))
+    return profile
+
+# detection engines: name -> function(initWave, vData, tStats, minScale) giving
+# a profile where lower values are better matches
+DETECTION_ENGINES = {
+    'mass': massProfile,
+    'matched-filter': matchedFilterProfile,
+    'hybrid': hybridProfile,
+}
+
+def engineThreshold(engine, disThresh=10, minScale=0.5):
+    """
+    :return: profile value below which a candidate is accepted by the engine
+    """
+    return 1 / (1 + minScale) if engine == 'matched-filter' else disThresh
+
+def selectEvents(distance_profile, wwidth, disThresh=10, tLabels=[],
+                 verbose=0, keepBest=True):
+    """
+    Greedily pick non-overlapping events from a distance profile, best match
+    first.  The best match is kept even when it is not below the threshold
+    (unless keepBest is False); after it, every candidate below the
+    threshold that does not fall within a window width of an already
+    selected event is kept.  Offsets left at infinity (never scored) are
+    never selected.
+    :param distance_profile: dissimilarity of each subsequence to the template
+    :param wwidth: template width in samples
+    :param disThresh: dissimilarity threshold for accepting a candidate
+    :param tLabels: time labels for the data the profile was computed over
+    :param verbose: how verbose (0-10) output should be
+    :param keepBest: keep the best match when nothing is below the threshold
+    :return: [event index, ...], [event dissimilarity, ...] ordered by index
+    """
     idx = int(np.argmin(distance_profile))
+    best = distance_profile[idx]
+    if not np.isfinite(best) or not (keepBest or best < disThresh):
+        if verbose > 2:
+            print("No match to the Blink Template was found")
+        return [], []
     if verbose > 2:
         print(f"The best match to Blink Template is located at index {idx} "
               f"(time: {tLabels[idx]})")
     disProf = np.argsort(distance_profile)
-    disThresh = 10 # 5 # 2
     candidateCount = np.argsort(np.where(distance_profile < disThresh)).size
     blinkIxs = [idx]  # blink start times
     blinkDis = [distance_profile[idx]]  # wave dissimilarity from template
-    wwidth = len(initWave)
     if verbose > 3:
         print(f"Adding Data Index, Time, Dissimilarity")
     for ix in disProf[:candidateCount]:
@@ -453,6 +745,47 @@ def findBlinks(initWave, vData, blinkDuration, sampleHz=1000,
     blinkDuo = sorted(zip(blinkIxs, blinkDis), key=lambda x:x[0])
     blinkIxs = [x[0] for x in blinkDuo]
     blinkDis = [x[1] for x in blinkDuo]
+    return blinkIxs, blinkDis
+
+def findBlinks(initWave, vData, blinkDuration, sampleHz=1000,
+                      tLabels=[], verbose=10, electrode=None, disThresh=10,
+                      tStats=None, distanceProfile=None, engine='mass', minScale=0.5):
+    """
+    Return a list of the start time of a blink
+    in seconds and a list of associated wave dissimilarities
+    :param vData: time series data
+    :param blinkDuration: expected blink duration in seconds
+    :param sampleHz: the number of samples per second in the data provided
+    :param verbose: how verbose (0-10) output should be
+    :param disThresh: dissimilarity threshold for accepting a blink
+    :param tStats: precomputed slidingStats(vData, len(initWave))
+    :param distanceProfile: precomputed distance profile of initWave over vData
+    :param engine: detection engine (see DETECTION_ENGINES)
+    :param minScale: smallest template scale accepted by the matched filter
+    :return: [blink_start_seconds, ...], [blink dissimilarity, ...]
+    """
+    window_size = int(blinkDuration * sampleHz)  # data points found in a pattern
+    if verbose > 2:
+        print(f"Looking across {len(vData) / sampleHz}s sampled at {sampleHz}Hz ({len(vData)} points) with a window of {blinkDuration}s ({window_size} points)")
+    if distanceProfile is not None:
+        distance_profile = distanceProfile
+    else:
+        distance_profile = DETECTION_ENGINES[engine](initWave, vData, tStats=tStats,
+                                                     minScale=minScale)
+    if verbose > 9:
+        import matplotlib.pyplot as plt
+        plt.plot(tLabels[:len(distance_profile)],
+                 distance_profile,
+                 label="Dissimilarity from target wave")
+        plt.title(f'Distance Profile E {electrode}')
+        plt.show()
+
+    # only MASS scores every offset on the same scale, so the other engines'
+    # gates decide on their own whether there is an event at all
+    blinkIxs, blinkDis = selectEvents(distance_profile, len(initWave),
+                                      disThresh=engineThreshold(engine, disThresh, minScale),
+                                      tLabels=tLabels, verbose=verbose,
+                                      keepBest=engine == 'mass')
     blinks = [tLabels[ix] for ix in blinkIxs]
     if verbose > 3:
         print(f"{len(blinks)} blinks found at {blinks}")
@@ -465,11 +798,118 @@ def findBlinks(initWave, vData, blinkDuration, sampleHz=1000,
                   labels=["Blink"] + blinks, title=f"{electrode} Waves Found ({len(blinkIxs)})")
     return blinks, blinkDis, blinkIxs
 
+def combineDistanceProfiles(profiles, weights=[], mode='MEAN', k=None, cap=None):
+    """
+    Merge the z-normalized distance profiles of several channels into one
+    aggregate profile.  'MEAN' takes the weighted mean of the profiles so the
+    result keeps the per-channel dissimilarity scale.  'KOFN' takes, at every
+    index, the k-th smallest channel distance so the aggregate falls below a
+    threshold only where at least k channels do.
+    :param profiles: list of distance profiles (one per channel)
+    :param weights: channel weights for 'MEAN' (default: equal weights)
+    :param mode: 'MEAN' or 'KOFN'
+    :param k: number of agreeing channels required for 'KOFN'
+    (default: a simple majority)
+    :param cap: value an unscored (infinite) channel distance counts as in
+    'MEAN' (default: the largest finite distance of any channel); offsets no
+    channel scored stay infinite
+    :return: ndarray aggregate distance profile
+    """
+    # templates may differ in length, so only keep indices every channel has
+    profLength = min(len(prof) for prof in profiles)
+    if mode.upper() == 'KOFN':
+        if k is None:
+            k = len(profiles) // 2 + 1
+        k = min(max(int(k), 1), len(profiles))
+        stacked = np.vstack([prof[:profLength] for prof in profiles])
+        return np.partition(stacked, k - 1, axis=0)[k - 1]
+    if weights == []:
+        weights = [1/len(profiles)] * len(profiles)
+    # accumulate channel by channel in float64 without widening every profile
+    if cap is None:
+        cap = max([np.max(prof[np.isfinite(prof)], initial=0) for prof in profiles])
+    consensus = np.zeros(profLength, dtype=np.float64)
+    unscored = np.ones(profLength, dtype=bool)
+    for weight, prof in zip(weights, profiles):
+        prof = prof[:profLength]
+        finite = np.isfinite(prof)
+        unscored &= ~finite
+        # an offset a channel did not score (e.g., screened out by 'hybrid')
+        # counts as that channel's worst match instead of spreading inf
+        consensus += weight * (prof if finite.all() else np.minimum(prof, cap))
+    consensus /= np.sum(weights)
+    consensus[unscored] = np.inf
+    return consensus
+
+def findConsensusBlinks(initWaves, vDatas, blinkDuration, sampleHz=1000,
+                        tLabels=[], verbose=10, electrodes=None,
+                        weights=[], mode='MEAN', k=None, disThresh=10,
+                        distanceProfiles=None, engine='mass', minScale=0.5):
+    """
+    Detect events once for a group of channels by combining each channel's
+    distance profile from its own template and selecting events from the
+    aggregate profile.  Every channel shares the resulting event indices.
+    :param initWaves: list of template waves (one per channel)
+    :param vDatas: list of time series data (one per channel)
+    :param blinkDuration: expected blink duration in seconds
+    :param sampleHz: the number of samples per second in the data provided
+    :param tLabels: time labels shared by the channels
+    :param verbose: how verbose (0-10) output should be
+    :param electrodes: electrode labels
+    :param weights: channel weights for the 'MEAN' aggregate
+    :param mode: 'MEAN' (weighted sum) or 'KOFN' (k-of-n below threshold)
+    :param k: number of agreeing channels required for 'KOFN'
+    :param disThresh: dissimilarity threshold for accepting a blink
+    :param distanceProfiles: precomputed distance profile per channel
+    :param engine: detection engine (see DETECTION_ENGINES)
+    :param minScale: smallest template scale accepted by the matched filter
+    :return: [blink_start_seconds, ...], [[blink dissimilarity, ...], ...]
+    per channel, [blink index, ...]
+    """
+    window_size = int(blinkDuration * sampleHz)  # data points found in a pattern
+    if verbose > 2:
+        print(f"Looking across {len(vDatas[0]) / sampleHz}s sampled at {sampleHz}Hz "
+              f"({len(vDatas[0])} points) on {len(vDatas)} channels with a "
+              f"window of {blinkDuration}s ({window_size} points)")
+    # profiles are computed in float64 and kept in the data's precision
+    dtype = np.result_type(np.asarray(vDatas[0]).dtype, np.float32)
+    if distanceProfiles is None:
+        distanceProfiles = [DETECTION_ENGINES[engine](initWave, vData, minScale=minScale)
+                            for initWave, vData in zip(initWaves, vDatas)]
+    profiles = [np.asarray(prof).astype(dtype, copy=False) for prof in distanceProfiles]
+    wwidth = max(len(initWave) for initWave in initWaves)
+    # offsets 'hybrid' screened out count as the largest z-normalized distance
+    cap = 2 * np.sqrt(wwidth) if engine == 'hybrid' else None
+    consensus = combineDistanceProfiles(profiles, weights=weights, mode=mode, k=k, cap=cap)
+    if verbose > 9:
+        import matplotlib.pyplot as plt
+        plt.plot(tLabels[:len(consensus)], consensus,
+                 label="Consensus dissimilarity from target waves")
+        plt.title(f'Consensus Distance Profile ({len(profiles)} channels)')
+        plt.show()
+
+    blinkIxs, _ = selectEvents(consensus, wwidth,
+                               disThresh=engineThreshold(engine, disThresh, minScale),
+                               tLabels=tLabels, verbose=verbose,
+                               keepBest=engine == 'mass')
+    blinks = [tLabels[ix] for ix in blinkIxs]
+    blinkDis = [[prof[ix] for ix in blinkIxs] for prof in profiles]
+    if verbose > 3:
+        print(f"{len(blinks)} consensus blinks found at {blinks}")
+    if verbose > 6:
+        plotMotifMatchesMultiElectrodes(vDatas, tLabels,
+                                        [blinkIxs] * len(vDatas), window_size,
+                                        title=f"Consensus Motif Matches ({len(blinkIxs)})",
+                                        electrodes=electrodes)
+    return blinks, blinkDis, blinkIxs
+
 def  zeroOutOfRange(data):
     minReal = -1 # -0.01
     maxReal = 1 #0.01
     badVal = 0
-    cleaned = [x if minReal < x < maxReal else badVal for x in data]
+    data = np.asarray(data)
+    cleaned = np.where((data > minReal) & (data < maxReal), data, badVal).astype(
+        np.result_type(data.dtype, np.float32), copy=False)
     return cleaned
 
 def stratifyForColors(chVals, ignores, binCount, mn, mx, ignoreVal):
@@ -497,6 +937,11 @@ def stratifyForColors(chVals, ignores, binCount, mn, mx, ignoreVal):
     return valueList
 
 def plotSensorStrengths(goodChannels, waveRespMetrics, electLabels, montageFunc, info):
+    import matplotlib.pyplot as plt
+    import matplotlib.cm as cm
+    from matplotlib import colors
+    from mne.channels import make_standard_montage
+    from mne.viz import plot_sensors
 
     montage = make_standard_montage('GSN-HydroCel-129')
     montage.ch_names[-1] = 'E129'
@@ -0,0 +1,124 @@
+import numpy as np
+
+# element name -> dtype used to store it ('duration' is a plain int)
+EVENT_FIELDS = {
+    'blinkWave': np.float64,
+    'blinks': np.float64,
+    'blinksIndecies': np.int64,
+    'dissimilarity': np.float64,
+    'duration': None,
+}
+VERSIONS = ('original', 'extended', 'Big')
+
+
+def _frozen(value, dtype):
+    """
+    Store a value as a read-only array.  Arrays that already have the right
+    dtype are wrapped in a view so they are shared rather than copied; the
+    caller's own array keeps its write flag.
+    :param value: ndarray, list or scalar sequence
+    :param dtype: numpy dtype to store it as
+    :return: read-only ndarray
+    """
+    if isinstance(value, np.ndarray) and (dtype is None or value.dtype == dtype):
+        arr = value.view()
+    else:
+        arr = np.array(value, dtype=dtype)
+    arr.flags.writeable = False
+    return arr
+
+
+class EventSet:
+    """
+    The events detected on one channel for one version of the template
+    ('original', 'extended' or 'Big').  Elements are held as read-only NumPy
+    arrays and remain reachable with the dictionary style
+    outcomes[chan][vers][elem] access used by readTemplateFile.  Because the
+    arrays are never written in place, snapshot() can share them instead of
+    deep copying.
+    """
+    __slots__ = tuple(EVENT_FIELDS)
+
+    def __init__(self, **elems):
+        for elem, value in elems.items():
+            self[elem] = value
+
+    def __getitem__(self, elem):
+        if elem not in EVENT_FIELDS:
+            raise KeyError(elem)
+        try:
+            return getattr(self, elem)
+        except AttributeError:
+            raise KeyError(elem) from None
+
+    def __setitem__(self, elem, value):
+        if elem not in EVENT_FIELDS:
+            raise KeyError(elem)
+        if elem == 'duration':
+            setattr(self, elem, int(value))
+        elif elem == 'blinkWave' and isinstance(value, np.ndarray):
+            # keep the template in whatever float precision it was built in
+            setattr(self, elem, _frozen(value, None))
+        else:
+            setattr(self, elem, _frozen(value, EVENT_FIELDS[elem]))
+
+    def __contains__(self, elem):
+        return elem in EVENT_FIELDS and hasattr(self, elem)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return f"EventSet({', '.join(self.keys())})"
+
+    def keys(self):
+        return [elem for elem in EVENT_FIELDS if hasattr(self, elem)]
+
+    def items(self):
+        return [(elem, getattr(self, elem)) for elem in self.keys()]
+
+    def snapshot(self):
+        """
+        Return a copy of this event set that shares the underlying
+        (read-only) arrays.
+        :return: EventSet
+        """
+        snap = EventSet()
+        for elem in self.keys():
+            object.__setattr__(snap, elem, getattr(self, elem))
+        return snap
+
+    def toJSON(self):
+        """
+        convert the event set to JSON serializable values
+        :return: dict of element name to list/int
+        """
+        return {elem: (value.tolist() if isinstance(value, np.ndarray) else value)
+                for elem, value in self.items()}
+
+    @classmethod
+    def fromJSON(cls, dataIn, dtype=None):
+        """
+        build an event set from the values written by toJSON()
+        :param dataIn: dict of element name to list/int
+        :param dtype: dtype of the template wave (default: float64)
+        :return: EventSet
+        """
+        unknown = set(dataIn) - set(EVENT_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown event set elements: {', '.join(sorted(unknown))}")
+        elems = dict(dataIn)
+        if dtype is not None and 'blinkWave' in elems:
+            elems['blinkWave'] = np.array(elems['blinkWave'], dtype=dtype)
+        return cls(**elems)
+
+
+def channelOutcomes():
+    """
+    Return the empty per-version results for one channel
+    :return: dict of version name to EventSet
+    """
+    return {vers: EventSet() for vers in VERSIONS}
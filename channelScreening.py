@@ -0,0 +1,156 @@
+import sys
+import argparse
+import numpy as np
+from blinkDection import MAX_REAL
+
+# a channel is excluded when any of its measures crosses one of these limits
+SCREEN_LIMITS = {
+    'flatFraction': 0.2,  # fraction of samples equal to the previous sample
+    'outOfRangeFraction': 0.01,  # fraction of samples with |value| >= MAX_REAL
+    'varianceRatio': 20.0,  # variance above (or below 1/ratio of) the median channel
+    'lineFraction': 0.5,  # share of the spectrum within 1Hz of the line frequency
+}
+
+
+def _readChunk(source, rows, start, stop):
+    # an mne Raw object reads the chunk from disk; arrays are sliced
+    if hasattr(source, 'get_data'):
+        return source.get_data(picks=rows, start=start, stop=stop)
+    return np.asarray(source[rows, start:stop], dtype=np.float64)
+
+
+def channelStats(source, rows, sampleRate=1000, lineFreq=60, chunkSeconds=60,
+                 flatTol=0.0):
+    """
+    Compute the screening measures of several channels in one sweep over the
+    recording, a chunk of samples (all channels at once) at a time.
+    :param source: mne Raw (read lazily with get_data) or channels x samples array
+    :param rows: channel indices to screen
+    :param sampleRate: samples per second
+    :param lineFreq: mains frequency (Hz)
+    :param chunkSeconds: length of the chunks processed at a time
+    :param flatTol: largest sample to sample change still counted as flat
+    :return: dict of measure name to ndarray (one value per channel)
+    """
+    rows = list(rows)
+    sampleCount = source.n_times if hasattr(source, 'get_data') else source.shape[1]
+    chunkSamples = max(int(chunkSeconds * sampleRate), sampleRate)
+    count = 0
+    mean = np.zeros(len(rows))
+    m2 = np.zeros(len(rows))  # sum of squared deviations from the mean
+    flat = np.zeros(len(rows))
+    outOfRange = np.zeros(len(rows))
+    # power spectrum of 1s segments, summed over the recording
+    power = np.zeros((len(rows), sampleRate // 2 + 1))
+    previous = None
+    for start in range(0, sampleCount, chunkSamples):
+        chunk = _readChunk(source, rows, start, min(start + chunkSamples, sampleCount))
+        n = chunk.shape[1]
+        # combine the chunk's mean and variance with the running ones (Chan et al.)
+        chunkMean = chunk.mean(axis=1)
+        chunkM2 = ((chunk - chunkMean[:, None]) ** 2).sum(axis=1)
+        diff = chunkMean - mean
+        total = count + n
+        mean += diff * n / total
+        m2 += chunkM2 + diff ** 2 * count * n / total
+        count = total
+
+        steps = np.abs(np.diff(chunk, axis=1, prepend=chunk[:, :1] if previous is None
+                               else previous))
+        flat += (steps <= flatTol).sum(axis=1) - (1 if previous is None else 0)
+        previous = chunk[:, -1:]
+        outOfRange += (np.abs(chunk) >= MAX_REAL).sum(axis=1)
+
+        segments = n // sampleRate
+        if segments > 0:
+            segs = chunk[:, :segments * sampleRate].reshape(len(rows), segments, sampleRate)
+            segs = segs - segs.mean(axis=2, keepdims=True)
+            power += (np.abs(np.fft.rfft(segs, axis=2)) ** 2).sum(axis=1)
+
+    freqs = np.fft.rfftfreq(sampleRate, d=1 / sampleRate)
+    lineBand = np.abs(freqs - lineFreq) <= 1
+    totalPower = power[:, 1:].sum(axis=1)
+    return {'flatFraction': flat / max(count - 1, 1),
+            'outOfRangeFraction': outOfRange / max(count, 1),
+            'variance': m2 / max(count, 1),
+            'lineFraction': np.divide(power[:, lineBand].sum(axis=1), totalPower,
+                                      out=np.zeros(len(rows)), where=totalPower > 0)}
+
+
+def screenChannels(source, rows, electLabels, sampleRate=1000, lineFreq=60,
+                   chunkSeconds=60, limits=SCREEN_LIMITS, targets=()):
+    """
+    Screen channels and report the ones that fail.  Target channels (the
+    ones the events are looked for on, usually periocular) are exempt from
+    the high variance test, since the events themselves raise their
+    variance; a warning is printed when one fails another test.
+    :param source: mne Raw or channels x samples array
+    :param rows: channel indices to screen
+    :param electLabels: list of string electrode labels (e.g., 'E1')
+    :param sampleRate: samples per second
+    :param lineFreq: mains frequency (Hz)
+    :param chunkSeconds: length of the chunks processed at a time
+    :param limits: dict of measure name to limit (see SCREEN_LIMITS)
+    :param targets: channel indices exempt from the high variance test
+    :return: list of passing channel indices, dict of failing channel index
+    to a list of reasons
+    """
+    rows = list(rows)
+    stats = channelStats(source, rows, sampleRate=sampleRate, lineFreq=lineFreq,
+                         chunkSeconds=chunkSeconds)
+    # variance is judged against the channels that have usable data
+    usable = ((stats['flatFraction'] <= limits['flatFraction'])
+              & (stats['outOfRangeFraction'] <= limits['outOfRangeFraction']))
+    medianVar = np.median(stats['variance'][usable]) if usable.any() else np.median(stats['variance'])
+    failures = {}
+    for ix, row in enumerate(rows):
+        reasons = []
+        if stats['flatFraction'][ix] > limits['flatFraction']:
+            reasons.append(f"flat {stats['flatFraction'][ix] * 100:.1f}% of samples")
+        if stats['outOfRangeFraction'][ix] > limits['outOfRangeFraction']:
+            reasons.append(f"{stats['outOfRangeFraction'][ix] * 100:.2f}% of samples "
+                           f"over {MAX_REAL}")
+        if stats['variance'][ix] > medianVar * limits['varianceRatio'] > 0:
+            if row not in targets:
+                reasons.append(f"variance {stats['variance'][ix]:.3g} over "
+                               f"{limits['varianceRatio']:g}x the median {medianVar:.3g}")
+        elif stats['variance'][ix] * limits['varianceRatio'] < medianVar:
+            reasons.append(f"variance {stats['variance'][ix]:.3g} under "
+                           f"1/{limits['varianceRatio']:g} of the median {medianVar:.3g}")
+        if stats['lineFraction'][ix] > limits['lineFraction']:
+            reasons.append(f"{stats['lineFraction'][ix] * 100:.0f}% of power at {lineFreq:g}Hz")
+        if reasons:
+            failures[row] = reasons
+    for row, reasons in failures.items():
+        print(f"Excluding {electLabels[row]}: {'; '.join(reasons)}")
+        if row in targets:
+            print(f"Warning: target channel {electLabels[row]} failed screening; "
+                  f"use --screenChannels NO to keep it")
+    print(f"Channel screening kept {len(rows) - len(failures)} of {len(rows)} channels")
+    return [row for row in rows if row not in failures], failures
+
+
+def parse_args(params) -> argparse.Namespace:
+    """Parses arguments from the command line."""
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--dataFile', type=str, default='data/raw/ACL_035_raw.set')
+    parser.add_argument('--sampleRate', type=int, default=1000)
+    parser.add_argument('--lineFreq', type=float, default=60)
+    parser.add_argument('--chunkSeconds', type=int, default=60)
+
+    args = parser.parse_args(params)
+    return args
+
+
+def main(params):
+    args = parse_args(params)
+    from mne.io.eeglab import read_raw_eeglab
+    raw = read_raw_eeglab(input_fname=args.dataFile)
+    return screenChannels(raw, range(len(raw.ch_names)), raw.ch_names,
+                          sampleRate=args.sampleRate, lineFreq=args.lineFreq,
+                          chunkSeconds=args.chunkSeconds)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,127 @@
+import sys
+import argparse
+import numpy as np
+from blinkDection import findBlinks, zeroOutOfRange
+from plotElectrodeResponses import getChannels, readRecording, learnTemplate
+
+
+def parse_args(params) -> argparse.Namespace:
+    """Parses arguments from the command line."""
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--dataFile', type=str, default='data/raw/ACL_035_raw.set')
+    parser.add_argument('--sampleRate', type=int, default=1000)
+    parser.add_argument('--eventDuration', type=int, default=300)
+    parser.add_argument('--channels', type=str, default='14 8 1')
+    parser.add_argument('--badChannels', type=str, default='44')
+    parser.add_argument('--learnStart', type=int, default=707)
+    parser.add_argument('--learnStop', type=int, default=721)
+    parser.add_argument('--findStart', type=int, default=900)
+    parser.add_argument('--findStop', type=int, default=1000)
+    parser.add_argument('--disThresh', type=float, default=10)
+    parser.add_argument('--tolerance', type=int, default=2,
+                        help='largest event onset difference (samples) counted as the same event')
+
+    args = parser.parse_args(params)
+    return args
+
+
+def runChannel(data, tLabels, electLabel, blinkDurationMS, sampleRate,
+               learnRange, findRange, disThresh):
+    """
+    learn a template and find its events on one channel (no plots)
+    :param data: the channel's data in the precision under test
+    :param tLabels: time labels for the recording
+    :param electLabel: electrode label
+    :param blinkDurationMS: event duration in samples
+    :param sampleRate: samples per second
+    :param learnRange: (start, stop) of the learning window in seconds
+    :param findRange: (start, stop) of the FIND range in seconds
+    :param disThresh: dissimilarity threshold for accepting an event
+    :return: template wave, found event indices, found dissimilarities
+    """
+    learnSlice = slice(learnRange[0] * sampleRate, learnRange[1] * sampleRate)
+    findSlice = slice(findRange[0] * sampleRate, findRange[1] * sampleRate)
+    blinkWave, _, _, _ = learnTemplate(data[learnSlice], tLabels[learnSlice],
+                                       blinkDurationMS, sampleRate, electLabel,
+                                       disThresh=disThresh)
+    _, foundDis, foundIXs = findBlinks(blinkWave, zeroOutOfRange(data[findSlice]),
+                                       blinkDurationMS / sampleRate,
+                                       sampleHz=sampleRate, tLabels=tLabels[findSlice],
+                                       verbose=0, electrode=electLabel,
+                                       disThresh=disThresh)
+    return blinkWave, np.asarray(foundIXs), np.asarray(foundDis)
+
+
+def matchedFraction(reference, test, tolerance):
+    """
+    :return: fraction of reference events with a test event within tolerance samples
+    """
+    if len(reference) == 0:
+        return 1.0 if len(test) == 0 else 0.0
+    if len(test) == 0:
+        return 0.0
+    test = np.sort(test)
+    pos = np.clip(np.searchsorted(test, reference), 1, len(test) - 1)
+    nearest = np.minimum(np.abs(test[pos - 1] - reference), np.abs(test[pos] - reference))
+    return float(np.mean(nearest <= tolerance))
+
+
+def compareDtypes(data64, tLabels, channelIndecies, electLabels, blinkDurationMS,
+                  sampleRate, learnRange, findRange, disThresh=10, tolerance=2):
+    """
+    Run the same LEARN/FIND on float64 data and its float32 copy and report
+    how far the float32 path departs from the float64 one.
+    :param data64: channels x samples float64 data
+    :param tLabels: time labels for the recording
+    :param channelIndecies: channels to compare
+    :param electLabels: list of string electrode labels (e.g., 'E1')
+    :param blinkDurationMS: event duration in samples
+    :param sampleRate: samples per second
+    :param learnRange: (start, stop) of the learning window in seconds
+    :param findRange: (start, stop) of the FIND range in seconds
+    :param disThresh: dissimilarity threshold for accepting an event
+    :param tolerance: onset difference (samples) still counted as the same event
+    :return: True when every channel finds the same events in both precisions
+    """
+    print("Electrode, events float64, events float32, matched (%), "
+          "template max rel err, max dissimilarity diff")
+    agree = True
+    for electIX in channelIndecies:
+        row64 = data64[electIX]
+        row32 = row64.astype(np.float32)
+        wave64, ixs64, dis64 = runChannel(row64, tLabels, electLabels[electIX], blinkDurationMS,
+                                          sampleRate, learnRange, findRange, disThresh)
+        wave32, ixs32, dis32 = runChannel(row32, tLabels, electLabels[electIX], blinkDurationMS,
+                                          sampleRate, learnRange, findRange, disThresh)
+        matched = min(matchedFraction(ixs64, ixs32, tolerance),
+                      matchedFraction(ixs32, ixs64, tolerance))
+        waveLen = min(len(wave64), len(wave32))
+        waveErr = (np.max(np.abs(wave64[:waveLen] - wave32[:waveLen]))
+                   / max(np.max(np.abs(wave64[:waveLen])), np.finfo(np.float64).tiny))
+        disDiff = (np.max(np.abs(dis64 - dis32)) if len(dis64) == len(dis32) and len(dis64)
+                   else np.nan)
+        print(f"{electLabels[electIX]}, {len(ixs64)}, {len(ixs32)}, {matched * 100:.1f}, "
+              f"{waveErr:.2e}, {disDiff:.2e}")
+        agree = agree and matched == 1.0
+    print(f"Data size float64: {data64[channelIndecies].nbytes / 1e6:.1f} MB, "
+          f"float32: {data64[channelIndecies].nbytes / 2e6:.1f} MB")
+    print("float32 results match float64" if agree else
+          "float32 results DIFFER from float64")
+    return agree
+
+
+def main(params):
+    args = parse_args(params)
+    _, allData, tLabels, electLabels = readRecording(args.dataFile)
+    _, goodChannels = getChannels(False, electLabels, args.channels, args.badChannels)
+    goodIndecies = [electLabels.index(x) for x in goodChannels]
+    return compareDtypes(allData, tLabels, goodIndecies, electLabels,
+                         args.eventDuration, args.sampleRate,
+                         (args.learnStart, args.learnStop),
+                         (args.findStart, args.findStop),
+                         disThresh=args.disThresh, tolerance=args.tolerance)
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main(sys.argv[1:]) else 1)
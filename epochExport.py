@@ -0,0 +1,103 @@
+import os
+import json
+import numpy as np
+
+
+def sidecarName(fName):
+    """
+    name of the JSON metadata file that accompanies an epoch file
+    :param fName: epoch (.npy) file name
+    :return: metadata file name
+    """
+    return os.path.splitext(fName)[0] + '.json'
+
+
+def exportEpochs(data, channelIndecies, starts, preWidth, width, fName,
+                 channelLabels=None, sampleRate=1000, dtype=None,
+                 flushEvery=64):
+    """
+    Write an (events x channels x samples) tensor of aligned event windows to
+    a memory-mapped .npy file, one event at a time so memory use does not grow
+    with the number of events, plus a JSON metadata sidecar.
+    :param data: channels x samples array (e.g., raw.get_data() output)
+    :param channelIndecies: rows of data to export
+    :param starts: event start sample indices shared by every channel, or one
+    list of start indices per exported channel
+    :param preWidth: samples to include before each event start
+    :param width: samples to include from each event start
+    :param fName: name of the .npy file to write
+    :param channelLabels: electrode labels for the exported channels
+    :param sampleRate: samples per second
+    :param dtype: floating point dtype of the stored epochs (default: data's dtype)
+    :param flushEvery: number of events written between flushes to disk
+    :return: shape of the tensor written
+    """
+    perChannel = len(starts) > 0 and np.ndim(starts[0]) > 0
+    if perChannel:
+        channelStarts = [np.asarray(s, dtype=np.int64) for s in starts]
+        eventCount = max([len(s) for s in channelStarts] + [0])
+    else:
+        channelStarts = [np.asarray(starts, dtype=np.int64)] * len(channelIndecies)
+        eventCount = len(starts)
+    dtype = np.dtype(dtype if dtype is not None else data.dtype)
+    if not np.issubdtype(dtype, np.floating):
+        raise ValueError(f"Epochs are padded with NaN, so {dtype} cannot store them; "
+                         f"use a floating point dtype")
+    sampleCount = len(data[channelIndecies[0]])
+    epochLen = int(preWidth) + int(width)
+    shape = (eventCount, len(channelIndecies), epochLen)
+
+    epochs = np.lib.format.open_memmap(fName, mode='w+', dtype=dtype, shape=shape)
+    for eIX in range(eventCount):
+        # windows that are missing or run off the recording are padded
+        epoch = np.full((len(channelIndecies), epochLen), np.nan, dtype=dtype)
+        if perChannel:
+            for cIX, electIX in enumerate(channelIndecies):
+                if eIX < len(channelStarts[cIX]):
+                    _copyWindow(epoch[cIX], data[electIX], channelStarts[cIX][eIX] - preWidth,
+                                sampleCount)
+        else:
+            first = channelStarts[0][eIX] - preWidth
+            lo, hi = max(first, 0), min(first + epochLen, sampleCount)
+            if lo < hi:
+                epoch[:, lo - first:hi - first] = data[channelIndecies, lo:hi]
+        epochs[eIX] = epoch
+        if (eIX + 1) % flushEvery == 0:
+            epochs.flush()
+    epochs.flush()
+    del epochs
+
+    metadata = {
+        'shape': [int(n) for n in shape],
+        'dtype': dtype.name,
+        'sampleRate': sampleRate,
+        'preWidth': int(preWidth),
+        'width': int(width),
+        'alignment': 'CHANNEL' if perChannel else 'COMMON',
+        'channels': [int(ch) for ch in channelIndecies],
+        'channelLabels': list(channelLabels) if channelLabels is not None else None,
+        'starts': ([s.tolist() for s in channelStarts] if perChannel
+                   else channelStarts[0].tolist() if channelStarts else []),
+    }
+    with open(sidecarName(fName), "w") as json_file:
+        json.dump(metadata, json_file)
+    print(f"Wrote {shape[0]} epochs x {shape[1]} channels x {shape[2]} samples to {fName}")
+    return shape
+
+
+def _copyWindow(dest, signal, first, sampleCount):
+    # copy signal[first:first + len(dest)] into dest, clipped to the recording
+    lo, hi = max(first, 0), min(first + len(dest), sampleCount)
+    if lo < hi:
+        dest[lo - first:hi - first] = signal[lo:hi]
+
+
+def openEpochs(fName):
+    """
+    open an epoch file lazily; samples are only read as they are indexed
+    :param fName: epoch (.npy) file name
+    :return: read-only memory-mapped epochs, metadata dict
+    """
+    with open(sidecarName(fName), "r") as json_file:
+        metadata = json.load(json_file)
+    return np.load(fName, mmap_mode='r'), metadata
@@ -0,0 +1,328 @@
+import sys
+import csv
+import json
+import time
+import argparse
+import tracemalloc
+import numpy as np
+try:
+    import resource
+except ImportError:  # not on Windows
+    resource = None
+from blinkDection import findBlinks, findConsensusBlinks, zeroOutOfRange
+from blinkResults import EventSet
+from plotElectrodeResponses import (getChannels, readRecording, learnTemplate,
+                                    learnTemplateMultiWindow, extendWindow, parseWindows)
+from jitCache import warmUp, DEFAULT_CACHE_DIR
+
+# pipeline settings a configuration may change and their defaults
+EVAL_DEFAULTS = {
+    'eventDuration': 300,
+    'disThresh': 10,
+    'delta': 0,  # 0 holds the event duration fixed (no dynamic window)
+    'learnWindows': '707-721',
+    'dtype': 'float64',
+    'detection': 'CHANNEL',
+    'consensusMode': 'MEAN',
+    'consensusK': None,
+    'engine': 'mass',
+    'minScale': 0.5,
+}
+METRIC_COLUMNS = ['reference', 'detected', 'matched', 'precision', 'recall',
+                  'onsetErrorMs', 'onsetBiasMs', 'runtime', 'peakMB', 'maxRssMB']
+# quality metrics compared by accepted()
+QUALITY_COLUMNS = ['precision', 'recall', 'onsetErrorMs']
+
+
+def parse_args(params) -> argparse.Namespace:
+    """Parses arguments from the command line."""
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--dataFile', type=str, default='data/raw/ACL_035_raw.set')
+    parser.add_argument('--events', type=str, default='',
+                        help='CSV of reference events (onset in seconds or latency '
+                             'in samples); default: the EEGLAB event table of dataFile')
+    parser.add_argument('--eventType', type=str, default='',
+                        help='only use reference events of this type/description')
+    parser.add_argument('--sampleRate', type=int, default=1000)
+    parser.add_argument('--channels', type=str, default='14 8 1')
+    parser.add_argument('--badChannels', type=str, default='44')
+    parser.add_argument('--findStart', type=int, default=900)
+    parser.add_argument('--findStop', type=int, default=1000)
+    parser.add_argument('--baseline', type=str, default='{}',
+                        help='JSON object of settings overriding EVAL_DEFAULTS '
+                             '(e.g., {"engine": "matched-filter"})')
+    parser.add_argument('--candidate', type=str, default='',
+                        help='JSON object of settings to compare with the baseline')
+    parser.add_argument('--matchWindow', type=float, default=150,
+                        help='largest onset difference (ms) for a detection to match')
+    parser.add_argument('--tolerance', type=float, default=0.02,
+                        help='largest drop in precision or recall accepted')
+    parser.add_argument('--onsetTolerance', type=float, default=5,
+                        help='largest growth of the mean onset error (ms) accepted')
+    parser.add_argument('--jitCache', type=str, default=DEFAULT_CACHE_DIR)
+
+    args = parser.parse_args(params)
+    return args
+
+
+def readConfiguration(configString):
+    """
+    :param configString: JSON object of settings
+    :return: dict of every setting in EVAL_DEFAULTS
+    """
+    config = json.loads(configString) if configString else {}
+    unknown = set(config) - set(EVAL_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown configuration settings: {', '.join(sorted(unknown))}")
+    return dict(EVAL_DEFAULTS, **config)
+
+
+def readReferenceEvents(fName, sampleRate=1000, eventType=''):
+    """
+    read reference event onsets from a CSV file ('onset' in seconds or
+    'latency' in samples, optional 'type') or from an EEGLAB .set event table
+    :param fName: .csv or .set file name
+    :param sampleRate: samples per second (for 'latency' columns)
+    :param eventType: only keep events of this type ('' keeps all)
+    :return: sorted ndarray of onsets in seconds
+    """
+    if fName.endswith('.set'):
+        import mne
+        annotations = mne.read_annotations(fName)
+        onsets = [onset for onset, description in zip(annotations.onset,
+                                                       annotations.description)
+                  if not eventType or description == eventType]
+    else:
+        onsets = []
+        with open(fName, "r", newline='') as csv_file:
+            for row in csv.DictReader(csv_file):
+                if eventType and row.get('type', '') != eventType:
+                    continue
+                if 'onset' in row:
+                    onsets.append(float(row['onset']))
+                else:
+                    onsets.append(float(row['latency']) / sampleRate)
+    return np.sort(np.asarray(onsets, dtype=np.float64))
+
+
+def matchEvents(reference, detected, window):
+    """
+    pair each detection with at most one reference event, closest pairs first
+    :param reference: reference onsets (s)
+    :param detected: detected onsets (s)
+    :param window: largest onset difference (s) for a pair
+    :return: list of (reference index, detected index)
+    """
+    reference, detected = np.asarray(reference), np.asarray(detected)
+    if len(reference) == 0 or len(detected) == 0:
+        return []
+    diffs = np.abs(detected[:, None] - reference[None, :])
+    detIXs, refIXs = np.nonzero(diffs <= window)
+    order = np.argsort(diffs[detIXs, refIXs], kind='stable')
+    usedRef, usedDet, pairs = set(), set(), []
+    for detIX, refIX in zip(detIXs[order], refIXs[order]):
+        if detIX in usedDet or refIX in usedRef:
+            continue
+        usedDet.add(detIX)
+        usedRef.add(refIX)
+        pairs.append((int(refIX), int(detIX)))
+    return pairs
+
+
+def scoreEvents(reference, detected, window):
+    """
+    :return: dict of counts, precision, recall and onset error (ms) of the
+    detections against the reference events
+    """
+    pairs = matchEvents(reference, detected, window)
+    errors = np.array([detected[d] - reference[r] for r, d in pairs]) * 1000
+    return {'reference': len(reference), 'detected': len(detected), 'matched': len(pairs),
+            'precision': len(pairs) / len(detected) if len(detected) else np.nan,
+            'recall': len(pairs) / len(reference) if len(reference) else np.nan,
+            'onsetErrorMs': float(np.mean(np.abs(errors))) if len(pairs) else np.nan,
+            'onsetBiasMs': float(np.mean(errors)) if len(pairs) else np.nan}
+
+
+def runConfiguration(data, tLabels, rows, labels, config, sampleRate, findRange):
+    """
+    run LEARN and FIND (no plots) for one configuration
+    :param data: channels x samples data, ideally read with the configuration's
+    dtype (other dtypes are converted a channel at a time)
+    :param tLabels: time labels for the recording
+    :param rows: rows of data to process
+    :param labels: electrode label for each row
+    :param config: dict of settings (see EVAL_DEFAULTS)
+    :param sampleRate: samples per second
+    :param findRange: (start, stop) of the FIND range in seconds
+    :return: list of detected onsets (s) per channel
+    """
+    duration = config['eventDuration']
+    dtype = np.dtype(config['dtype'])
+    windows = parseWindows(config['learnWindows'])
+    first = min(start for start, _ in windows) * sampleRate
+    findSlice = slice(findRange[0] * sampleRate, findRange[1] * sampleRate)
+    waves, findData = [], []
+    for row, label in zip(rows, labels):
+        channel = data[row].astype(dtype, copy=False)
+        if len(windows) > 1:
+            blinkWave, blinks, blinkDis, blinkIXs = learnTemplateMultiWindow(
+                [channel[start * sampleRate:stop * sampleRate] for start, stop in windows],
+                [tLabels[start * sampleRate:stop * sampleRate] for start, stop in windows],
+                [start * sampleRate - first for start, _ in windows],
+                duration, sampleRate, label, disThresh=config['disThresh'])
+        else:
+            learnSlice = slice(windows[0][0] * sampleRate, windows[0][1] * sampleRate)
+            sequ, learnLabels = channel[learnSlice], tLabels[learnSlice]
+            cache = {}
+            blinkWave, blinks, blinkDis, blinkIXs = learnTemplate(
+                sequ, learnLabels, duration, sampleRate, label,
+                disThresh=config['disThresh'], cache=cache)
+            if config['delta'] > 0:
+                signals = {'original': EventSet(blinkWave=blinkWave, blinks=blinks,
+                                                blinksIndecies=blinkIXs,
+                                                dissimilarity=blinkDis, duration=duration)}
+                blinkWave = extendWindow(len(blinks), config['delta'], signals, duration,
+                                         sampleRate, sequ, learnLabels, label, verbose=0,
+                                         disThresh=config['disThresh'],
+                                         cache=cache)['blinkWave']
+        waves.append(blinkWave)
+        findData.append(zeroOutOfRange(channel[findSlice]))
+
+    findLabels = tLabels[findSlice]
+    if config['detection'] == 'CONSENSUS' and len(rows) > 1:
+        blinks, _, _ = findConsensusBlinks(waves, findData, duration / sampleRate,
+                                           sampleHz=sampleRate, tLabels=findLabels,
+                                           verbose=0, electrodes=list(labels),
+                                           mode=config['consensusMode'],
+                                           k=config['consensusK'],
+                                           disThresh=config['disThresh'],
+                                           engine=config['engine'],
+                                           minScale=config['minScale'])
+        return [list(blinks)] * len(rows)
+    return [findBlinks(wave, sequ, len(wave) / sampleRate, sampleHz=sampleRate,
+                       tLabels=findLabels, verbose=0, electrode=label,
+                       disThresh=config['disThresh'], engine=config['engine'],
+                       minScale=config['minScale'])[0]
+            for wave, sequ, label in zip(waves, findData, labels)]
+
+
+def maxRssMB():
+    """
+    :return: the process's peak resident set size so far (MB), which unlike
+    tracemalloc includes numba and other native allocations (nan where the
+    resource module is missing)
+    """
+    if resource is None:
+        return np.nan
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3  # bytes on macOS, KB elsewhere
+
+
+def evaluate(data, tLabels, rows, labels, config, reference, sampleRate, findRange,
+             matchWindow=150):
+    """
+    run a configuration and score it against the reference events.  A
+    traced run measures the peak memory, then the runtime comes from a
+    second run without tracing, since tracemalloc slows allocation-heavy
+    code; the traced run also pays any first-call costs (kernels not in the
+    cache, imports) so they do not land in the runtime.
+    tracemalloc only sees Python and NumPy allocations, so 'maxRssMB' gives
+    the process's peak RSS as well (a high-water mark over everything run
+    so far, so it only grows from one configuration to the next).
+    :param matchWindow: largest onset difference (ms) for a detection to match
+    :return: dict of pooled metrics, list of per-channel metric dicts
+    """
+    inRange = reference[(reference >= findRange[0]) & (reference < findRange[1])]
+    tracemalloc.start()
+    runConfiguration(data, tLabels, rows, labels, config, sampleRate, findRange)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    tic = time.perf_counter()
+    detected = runConfiguration(data, tLabels, rows, labels, config, sampleRate, findRange)
+    runtime = time.perf_counter() - tic
+    perChannel = [scoreEvents(inRange, np.asarray(found, dtype=np.float64), matchWindow / 1000)
+                  for found in detected]
+    matched = sum(score['matched'] for score in perChannel)
+    found = sum(score['detected'] for score in perChannel)
+    total = len(inRange) * len(perChannel)
+    errors = [score['onsetErrorMs'] * score['matched'] for score in perChannel if score['matched']]
+    biases = [score['onsetBiasMs'] * score['matched'] for score in perChannel if score['matched']]
+    pooled = {'reference': len(inRange), 'detected': found, 'matched': matched,
+              'precision': matched / found if found else np.nan,
+              'recall': matched / total if total else np.nan,
+              'onsetErrorMs': sum(errors) / matched if matched else np.nan,
+              'onsetBiasMs': sum(biases) / matched if matched else np.nan,
+              'runtime': runtime, 'peakMB': peak / 1e6, 'maxRssMB': maxRssMB()}
+    return pooled, perChannel
+
+
+def accepted(baseline, candidate, tolerance=0.02, onsetTolerance=5):
+    """
+    compare the candidate's quality with the baseline's.  A metric the
+    baseline has no value for (e.g., precision without detections) cannot
+    be compared, so it is skipped and reported instead of failing the
+    candidate.
+    :return: True when every comparable metric is within tolerance of the
+    baseline, list of the metrics that were not comparable
+    """
+    limits = {'precision': baseline['precision'] - tolerance,
+              'recall': baseline['recall'] - tolerance,
+              'onsetErrorMs': baseline['onsetErrorMs'] + onsetTolerance}
+    notComparable = [column for column in QUALITY_COLUMNS if np.isnan(baseline[column])]
+    ok = all(candidate[column] >= limits[column] for column in ['precision', 'recall']
+             if column not in notComparable)
+    if 'onsetErrorMs' not in notComparable:
+        ok = ok and not candidate['onsetErrorMs'] > limits['onsetErrorMs']
+    return ok, notComparable
+
+
+def printComparison(results, names):
+    print(f"metric, {', '.join(names)}")
+    for column in METRIC_COLUMNS:
+        print(f"{column}, " + ', '.join(f"{res[column]:.3f}" if isinstance(res[column], float)
+                                        else str(res[column]) for res in results))
+
+
+def main(params):
+    args = parse_args(params)
+    if args.jitCache.upper() != 'NO':
+        # load (or compile) the kernels before anything is measured, so the
+        # baseline does not pay for them in its peak memory
+        warmUp(args.jitCache, m=EVAL_DEFAULTS['eventDuration'])
+    configs = [readConfiguration(args.baseline)]
+    if args.candidate:
+        configs.append(readConfiguration(args.candidate))
+    reference = readReferenceEvents(args.events if args.events else args.dataFile,
+                                    sampleRate=args.sampleRate, eventType=args.eventType)
+
+    results = []
+    loadedDtype = None
+    for config in configs:
+        if config['dtype'] != loadedDtype:
+            # read in the configuration's dtype rather than converting a float64 copy
+            allData = None
+            _, allData, tLabels, electLabels = readRecording(args.dataFile,
+                                                             dtype=config['dtype'])
+            _, goodChannels = getChannels(False, electLabels, args.channels, args.badChannels)
+            goodIndecies = [electLabels.index(x) for x in goodChannels]
+            loadedDtype = config['dtype']
+        pooled, perChannel = evaluate(allData, tLabels, goodIndecies, goodChannels, config,
+                                      reference, args.sampleRate,
+                                      (args.findStart, args.findStop), args.matchWindow)
+        for label, score in zip(goodChannels, perChannel):
+            print(f"{label}: precision {score['precision']:.3f} recall {score['recall']:.3f} "
+                  f"onset error {score['onsetErrorMs']:.1f}ms")
+        results.append(pooled)
+    printComparison(results, ['baseline', 'candidate'][:len(results)])
+    if len(results) < 2:
+        return True
+    ok, notComparable = accepted(results[0], results[1], args.tolerance, args.onsetTolerance)
+    if notComparable:
+        print(f"Not comparable (baseline has no value): {', '.join(notComparable)}")
+    print("Candidate ACCEPTED" if ok else "Candidate REJECTED: quality dropped beyond tolerance")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main(sys.argv[1:]) else 1)
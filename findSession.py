@@ -0,0 +1,118 @@
+import os
+import json
+import hashlib
+import numpy as np
+from blinkDection import asFloat64, zeroOutOfRange, DETECTION_ENGINES
+
+
+def recordingKey(fName):
+    """
+    identify a recording by its path, size and modification time so a
+    session is discarded when the file changes
+    :param fName: recording file name
+    :return: key string
+    """
+    stat = os.stat(fName)
+    return f"{os.path.abspath(fName)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+
+def templateKey(electIX, template, engine='mass', minScale=0.5):
+    """
+    :param electIX: channel index of the template
+    :param template: template wave
+    :param engine: detection engine the profile is computed with
+    :param minScale: matched filter gate (only changes the 'hybrid' profile)
+    :return: key string for the channel's distance profile with this template
+    """
+    digest = hashlib.sha1(asFloat64(template).tobytes()).hexdigest()[:16]
+    if engine == 'hybrid':
+        engine = f"{engine}{minScale:g}"
+    return f"{electIX}_{len(template)}_{digest}_{engine}"
+
+
+class FindSession:
+    """
+    Distance profiles from earlier FIND runs on one recording, stored per
+    channel and template.  A profile is kept over one contiguous range of
+    window starts; when a later FIND range overlaps or touches it, the profile
+    is only computed over the samples before and after it (each with a template-length
+    overlap at the seam) and the pieces are joined, so the profile, and the
+    events selected from it, are the same as a cold run over the full range.
+    """
+
+    def __init__(self, fName, recordingName):
+        """
+        :param fName: session file (.npz)
+        :param recordingName: recording the profiles are computed on
+        """
+        self.fName = fName
+        self.key = recordingKey(recordingName)
+        self.entries = {}  # template key -> (first window start, profile)
+        self.computed = 0  # samples profiles were computed over in this process
+        self.reused = 0  # window starts taken from the stored profiles
+        if os.path.isfile(fName):
+            with np.load(fName) as stored:
+                meta = json.loads(str(stored['meta']))
+                if meta['recording'] == self.key:
+                    self.entries = {name: (start, stored[name])
+                                    for name, start in meta['starts'].items()}
+                else:
+                    print(f"FIND session {fName} belongs to another recording (or the "
+                          f"recording changed); starting a new session")
+
+    def _profile(self, template, data, first, stop, engine, minScale):
+        self.computed += stop - first
+        return DETECTION_ENGINES[engine](template, zeroOutOfRange(data[first:stop]),
+                                         minScale=minScale)
+
+    def distanceProfile(self, electIX, template, data, startIX, endIX, engine='mass',
+                        minScale=0.5):
+        """
+        distance profile of a channel's template over data[startIX:endIX],
+        computing only the part not already stored
+        :param electIX: channel index of the data
+        :param template: template wave
+        :param data: the channel's full recording
+        :param startIX: first sample of the FIND range
+        :param endIX: end (exclusive) of the FIND range
+        :param engine: detection engine (see DETECTION_ENGINES)
+        :param minScale: smallest template scale accepted by the matched filter
+        :return: ndarray float64 distance profile (endIX - startIX - m + 1 values)
+        """
+        m = len(template)
+        name = templateKey(electIX, template, engine, minScale)
+        wantStop = endIX - m + 1  # end (exclusive) of the window starts needed
+        if name in self.entries:
+            first, profile = self.entries[name]
+            stop = first + len(profile)
+            if startIX <= stop and wantStop >= first:
+                pieces = []
+                if startIX < first:
+                    pieces.append(self._profile(template, data, startIX, first + m - 1,
+                                                engine, minScale))
+                pieces.append(profile)
+                if wantStop > stop:
+                    pieces.append(self._profile(template, data, stop, endIX, engine, minScale))
+                self.reused += min(stop, wantStop) - max(first, startIX)
+                first = min(first, startIX)
+                profile = np.concatenate(pieces)
+                self.entries[name] = (first, profile)
+                return profile[startIX - first:wantStop - first]
+        # nothing stored, or the new range is apart from the stored one
+        profile = self._profile(template, data, startIX, endIX, engine, minScale)
+        self.entries[name] = (startIX, profile)
+        return profile
+
+    def save(self):
+        """
+        write the session file (replacing it once fully written)
+        """
+        meta = {'recording': self.key,
+                'starts': {name: int(first) for name, (first, _) in self.entries.items()}}
+        tmpName = self.fName + '.tmp'
+        with open(tmpName, 'wb') as session_file:
+            np.savez(session_file, meta=np.array(json.dumps(meta)),
+                     **{name: profile for name, (_, profile) in self.entries.items()})
+        os.replace(tmpName, self.fName)
+        print(f"FIND session saved to {self.fName}: profiles computed over "
+              f"{self.computed} samples, {self.reused} window starts reused")
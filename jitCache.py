@@ -0,0 +1,98 @@
+import os
+import sys
+import time
+import argparse
+import importlib
+
+_IMPORTED = time.perf_counter()
+
+# on-disk cache of the compiled stumpy kernels, shared by every process
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'PhysioProcessing', 'numba')
+# stumpy modules holding the kernels behind stumpy.stump and stumpy.mass
+STUMPY_MODULES = ('core', 'stump')
+
+
+def secondsSinceStart():
+    """
+    Wall-clock seconds since this process started.  Uses /proc on Linux and
+    falls back to the time this module was imported elsewhere.
+    :return: seconds
+    """
+    try:
+        with open('/proc/self/stat', 'r') as stat_file:
+            # the command name may contain spaces, so count fields after ')'
+            startTicks = int(stat_file.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime', 'r') as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        return uptime - startTicks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return time.perf_counter() - _IMPORTED
+
+
+def enableKernelCache(cacheDir=DEFAULT_CACHE_DIR):
+    """
+    Turn on Numba's on-disk caching for the stumpy kernels used by the
+    pipeline so that they are compiled once and then loaded by every later
+    process instead of being JIT compiled again.  Call before the first
+    stumpy.stump/stumpy.mass call.
+    :param cacheDir: directory holding the compiled kernels
+    :return: number of kernels with caching enabled
+    """
+    os.makedirs(cacheDir, exist_ok=True)
+    os.environ['NUMBA_CACHE_DIR'] = cacheDir
+    import numba
+    from numba.core.dispatcher import Dispatcher
+    numba.config.CACHE_DIR = cacheDir
+    kernelCount = 0
+    for moduleName in STUMPY_MODULES:
+        module = importlib.import_module(f"stumpy.{moduleName}")
+        for obj in vars(module).values():
+            if isinstance(obj, Dispatcher) and obj.py_func.__module__ == module.__name__:
+                obj.enable_caching()
+                kernelCount += 1
+    return kernelCount
+
+
+def warmUp(cacheDir=DEFAULT_CACHE_DIR, m=300, n=3000):
+    """
+    Compile (or load) the stumpy kernels the pipeline uses by running them on
+    a small random series, filling the persistent cache.
+    :param cacheDir: directory holding the compiled kernels
+    :param m: template length used for the warm-up
+    :param n: series length used for the warm-up
+    :return: seconds spent
+    """
+    import numpy as np
+    import stumpy
+    tic = time.perf_counter()
+    kernelCount = enableKernelCache(cacheDir)
+    series = np.random.default_rng(0).normal(size=n)
+    stumpy.stump(series, m=m)  # self-join (LEARN)
+    stumpy.stump(series[:n // 2], m, series[n // 2:], ignore_trivial=False)  # AB-join
+    stumpy.mass(series[:m], series)  # distance profile (FIND)
+    stumpy.core.compute_mean_std(series, m)
+    elapsed = time.perf_counter() - tic
+    print(f"{kernelCount} stumpy kernels cached in {cacheDir} ({elapsed:.2f}s)")
+    return elapsed
+
+
+def parse_args(params) -> argparse.Namespace:
+    """Parses arguments from the command line."""
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--cacheDir', type=str, default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--eventDuration', type=int, default=300)
+
+    args = parser.parse_args(params)
+    return args
+
+
+def main(params):
+    args = parse_args(params)
+    warmUp(args.cacheDir, m=args.eventDuration, n=10 * args.eventDuration)
+    print(f"Time from process start: {secondsSinceStart():.2f}s")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
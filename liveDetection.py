@@ -0,0 +1,362 @@
+import os
+import sys
+import json
+import time
+import struct
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import stumpy
+from blinkDection import asFloat64, zeroOutOfRange, selectEvents
+from plotElectrodeResponses import readTemplateFile
+from jitCache import enableKernelCache, DEFAULT_CACHE_DIR
+
+# A frame is a header followed by channels x samples little-endian float32
+# values, channel-major.  firstSample is the index of the block's first sample
+# in the stream so that gaps (e.g., dropped blocks) can be detected.
+FRAME_MAGIC = b'BLK1'
+FRAME_HEADER = struct.Struct('<4sHIQ')  # magic, channels, samples, firstSample
+FRAME_DTYPE = np.dtype('<f4')
+
+
+def packFrame(block, firstSample):
+    """
+    :param block: channels x samples data
+    :param firstSample: stream index of the block's first sample
+    :return: bytes of one frame
+    """
+    block = np.ascontiguousarray(block, dtype=FRAME_DTYPE)
+    return (FRAME_HEADER.pack(FRAME_MAGIC, block.shape[0], block.shape[1], firstSample)
+            + block.tobytes())
+
+
+async def readFrame(reader):
+    """
+    read one frame from a stream
+    :param reader: asyncio StreamReader
+    :return: (firstSample, channels x samples ndarray) or None at end of stream
+    """
+    try:
+        header = await reader.readexactly(FRAME_HEADER.size)
+    except asyncio.IncompleteReadError:
+        return None
+    magic, channels, samples, firstSample = FRAME_HEADER.unpack(header)
+    if magic != FRAME_MAGIC:
+        raise ValueError(f"Bad frame magic {magic!r}")
+    payload = await reader.readexactly(channels * samples * FRAME_DTYPE.itemsize)
+    return firstSample, np.frombuffer(payload, dtype=FRAME_DTYPE).reshape(channels, samples)
+
+
+def parseAddress(address):
+    """
+    :param address: 'host:port' for TCP, anything else is a Unix socket path
+    :return: ('tcp', host, port) or ('unix', path, None)
+    """
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return 'tcp', host or '127.0.0.1', int(port)
+    return 'unix', address, None
+
+
+class StreamDetector:
+    """
+    Incremental FIND over a sample stream.  Every block is prefixed with the
+    last m-1 samples of the previous one so MASS only runs over the windows the
+    block completes.  selectEvents only lets candidates (distances below the
+    threshold) less than a template width apart affect each other, so the
+    candidates are grouped into clusters split by gaps of at least a width;
+    once a cluster can no longer grow it is passed through selectEvents on its
+    own, which accepts the same events as a batch run over the whole profile.
+    Known difference: when nothing in the recording falls below the threshold
+    the batch run still reports its single best match and the stream does not.
+    """
+
+    def __init__(self, templates, channelRows, electLabels, disThresh=10):
+        """
+        :param templates: template wave per channel
+        :param channelRows: row of each channel in the incoming blocks
+        :param electLabels: label of each channel
+        :param disThresh: dissimilarity threshold for accepting an event
+        """
+        self.templates = [asFloat64(t) for t in templates]
+        self.channelRows = list(channelRows)
+        self.electLabels = list(electLabels)
+        self.disThresh = disThresh
+        self.reset(0)
+
+    def reset(self, nextSample):
+        """
+        forget the stream history, e.g. after a gap
+        :param nextSample: stream index of the next expected sample
+        """
+        self.nextSample = nextSample
+        self.tails = [np.zeros(0) for _ in self.templates]
+        # distances not yet decided on and the stream index of the first one
+        self.pending = [np.zeros(0) for _ in self.templates]
+        self.pendingStart = [nextSample for _ in self.templates]
+
+    def process(self, firstSample, block):
+        """
+        :param firstSample: stream index of the block's first sample
+        :param block: channels x samples data
+        :return: list of event dicts decided by this block
+        """
+        if block.shape[0] <= max(self.channelRows):
+            raise ValueError(f"Block has {block.shape[0]} rows but the templates read "
+                             f"row {max(self.channelRows)} (see --channelMap)")
+        events = []
+        if firstSample != self.nextSample:
+            # decide what was pending before the gap, then start over
+            events.extend(self.flush())
+            self.reset(firstSample)
+        self.nextSample = firstSample + block.shape[1]
+        for cIX, (template, row) in enumerate(zip(self.templates, self.channelRows)):
+            m = len(template)
+            series = np.concatenate([self.tails[cIX], asFloat64(zeroOutOfRange(block[row]))])
+            self.tails[cIX] = series[-(m - 1):] if m > 1 else series[:0]
+            if len(series) < m:
+                continue
+            profile = stumpy.mass(template, series)
+            if self.pending[cIX].size == 0:
+                self.pendingStart[cIX] = self.nextSample - len(series)
+            self.pending[cIX] = np.concatenate([self.pending[cIX], profile])
+            events.extend(self._decide(cIX, m))
+        return events
+
+    def flush(self):
+        """
+        decide every pending distance, e.g. at the end of the stream
+        :return: list of event dicts
+        """
+        events = []
+        for cIX, template in enumerate(self.templates):
+            events.extend(self._decide(cIX, len(template), final=True))
+        return events
+
+    def _decide(self, cIX, m, final=False):
+        pending = self.pending[cIX]
+        candidates = np.flatnonzero(pending < self.disThresh)
+        if final:
+            closedUpTo = len(pending)
+        elif len(candidates) == 0:
+            closedUpTo = max(len(pending) - (m - 1), 0)
+        else:
+            # a cluster is closed once the m-1 distances after its last
+            # candidate are known and none of them is a candidate
+            breaks = np.flatnonzero(np.diff(candidates) >= m)
+            lasts = np.append(candidates[breaks], candidates[-1])
+            firsts = np.insert(candidates[breaks + 1], 0, candidates[0])
+            closed = lasts + m <= len(pending)
+            closedUpTo = (int(firsts[np.argmin(closed)]) if not closed.all()
+                          else max(len(pending) - (m - 1), int(lasts[-1]) + 1))
+        events = []
+        if closedUpTo > 0 and (pending[:closedUpTo] < self.disThresh).any():
+            decided = pending[:closedUpTo]
+            for ix, dis in zip(*selectEvents(decided, m, disThresh=self.disThresh)):
+                events.append({'type': 'event', 'channel': self.channelRows[cIX],
+                               'electrode': self.electLabels[cIX],
+                               'sample': self.pendingStart[cIX] + ix,
+                               'dissimilarity': float(dis)})
+        self.pending[cIX] = pending[closedUpTo:]
+        self.pendingStart[cIX] += closedUpTo
+        return events
+
+
+class BlockQueue:
+    """
+    Bounded queue between the socket reader and the detector.  'BLOCK' stops
+    reading from the socket while the queue is full, pushing back on the
+    sender; 'DROP' discards the oldest queued block to keep latency bounded.
+    """
+
+    def __init__(self, maxsize, policy='BLOCK'):
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        self.policy = policy
+        self.dropped = 0
+
+    async def put(self, item):
+        if self.policy == 'DROP' and self.queue.full():
+            self.queue.get_nowait()
+            self.queue.task_done()
+            self.dropped += 1
+        await self.queue.put(item)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def qsize(self):
+        return self.queue.qsize()
+
+
+def latencySummary(latencies):
+    """
+    :param latencies: per-block latencies in ms
+    :return: dict of summary statistics
+    """
+    if len(latencies) == 0:
+        return {'blocks': 0}
+    latencies = np.asarray(latencies)
+    return {'blocks': len(latencies), 'meanMs': float(np.mean(latencies)),
+            'p95Ms': float(np.percentile(latencies, 95)), 'maxMs': float(np.max(latencies))}
+
+
+async def sendMessage(writer, message):
+    writer.write((json.dumps(message) + '\n').encode())
+    await writer.drain()
+
+
+async def handleClient(reader, writer, detectorFactory, sampleRate, queueSize, policy,
+                       executor):
+    """
+    read frames from one client into a bounded queue, run the detector on
+    them in a worker thread and write events and per-block metrics back as
+    JSON lines
+    """
+    detector = detectorFactory()
+    blocks = BlockQueue(queueSize, policy)
+    loop = asyncio.get_running_loop()
+    latencies = []
+
+    async def receive():
+        try:
+            while True:
+                frame = await readFrame(reader)
+                if frame is None:
+                    break
+                await blocks.put((time.perf_counter(), frame))
+        except (ConnectionError, ValueError, asyncio.IncompleteReadError) as err:
+            # hand the error to detect() so the client hears about it
+            await blocks.queue.put(err)
+            return
+        await blocks.queue.put(None)
+
+    async def detect():
+        while True:
+            item = await blocks.get()
+            if isinstance(item, Exception):
+                raise item
+            if item is None:
+                break
+            received, (firstSample, block) = item
+            started = time.perf_counter()
+            events = await loop.run_in_executor(executor, detector.process, firstSample, block)
+            done = time.perf_counter()
+            for event in events:
+                event['time'] = event['sample'] / sampleRate
+                await sendMessage(writer, event)
+            latencies.append((done - received) * 1000)
+            await sendMessage(writer, {'type': 'block', 'firstSample': firstSample,
+                                       'samples': block.shape[1],
+                                       'queueMs': (started - received) * 1000,
+                                       'computeMs': (done - started) * 1000,
+                                       'latencyMs': latencies[-1],
+                                       'queueDepth': blocks.qsize(),
+                                       'dropped': blocks.dropped})
+        # end of stream: decide the distances still waiting on later samples
+        for event in await loop.run_in_executor(executor, detector.flush):
+            event['time'] = event['sample'] / sampleRate
+            await sendMessage(writer, event)
+
+    receiver = asyncio.ensure_future(receive())
+    try:
+        await detect()
+        await receiver
+        summary = dict(latencySummary(latencies), type='summary', dropped=blocks.dropped)
+        print(f"Client done: {summary}")
+        await sendMessage(writer, summary)
+    except (ConnectionError, ValueError, asyncio.IncompleteReadError) as err:
+        print(f"Client dropped: {err}")
+        try:
+            await sendMessage(writer, {'type': 'error', 'message': str(err)})
+        except ConnectionError:
+            pass
+    finally:
+        receiver.cancel()
+        writer.close()
+
+
+def parseChannelMap(mapString, templateChannels):
+    """
+    :param mapString: space-delimited 'channel:row' pairs mapping a template's
+    channel index to the row of the incoming blocks carrying it (e.g., '13:0')
+    :param templateChannels: channel indices of the templates
+    :return: block row for each template channel (unmapped channels keep
+    their own index)
+    """
+    rows = {}
+    for pair in mapString.split():
+        channel, row = pair.split(':')
+        rows[int(channel)] = int(row)
+    unknown = set(rows) - set(templateChannels)
+    if unknown:
+        raise ValueError(f"--channelMap names channels without templates: {sorted(unknown)}")
+    return [rows.get(channel, channel) for channel in templateChannels]
+
+
+def parse_args(params) -> argparse.Namespace:
+    """Parses arguments from the command line."""
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--templateFile', type=str, default='templates.json')
+    parser.add_argument('--templateVersion', choices=['original', 'extended', 'Big'],
+                        default='original')
+    parser.add_argument('--listen', type=str, default='127.0.0.1:8765',
+                        help="'host:port' for TCP or a Unix socket path")
+    parser.add_argument('--channelMap', type=str, default='',
+                        help="'channel:row' pairs giving the block row of each template "
+                             "channel, e.g. '13:0' for a one-channel BYB .wav "
+                             "(default: the template's channel index)")
+    parser.add_argument('--sampleRate', type=int, default=1000)
+    parser.add_argument('--disThresh', type=float, default=10)
+    parser.add_argument('--queueSize', type=int, default=8)
+    parser.add_argument('--policy', choices=['BLOCK', 'DROP'], default='BLOCK')
+    parser.add_argument('--jitCache', type=str, default=DEFAULT_CACHE_DIR)
+
+    args = parser.parse_args(params)
+    return args
+
+
+async def serve(args):
+    templates = readTemplateFile(args.templateFile)
+    channels = sorted(templates)
+    waves = [templates[chan][args.templateVersion]['blinkWave'] for chan in channels]
+    labels = [f"E{chan + 1}" for chan in channels]
+    channelRows = parseChannelMap(args.channelMap, channels)
+    # one detection thread keeps blocks in order; the event loop stays free to read
+    executor = ThreadPoolExecutor(max_workers=1)
+
+    def detectorFactory():
+        return StreamDetector(waves, channelRows, labels, disThresh=args.disThresh)
+
+    async def onClient(reader, writer):
+        await handleClient(reader, writer, detectorFactory, args.sampleRate,
+                           args.queueSize, args.policy, executor)
+
+    kind, host, port = parseAddress(args.listen)
+    if kind == 'tcp':
+        server = await asyncio.start_server(onClient, host, port)
+    else:
+        if os.path.exists(host):
+            os.remove(host)
+        server = await asyncio.start_unix_server(onClient, host)
+    print(f"Detecting {len(waves)} channel(s) "
+          f"({', '.join(f'{lab} in row {row}' for lab, row in zip(labels, channelRows))}) "
+          f"on {args.listen}, "
+          f"queue {args.queueSize} ({args.policy})")
+    async with server:
+        await server.serve_forever()
+
+
+def main(params):
+    args = parse_args(params)
+    if args.jitCache.upper() != 'NO':
+        enableKernelCache(args.jitCache)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,111 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+import numpy as np
+from liveDetection import packFrame, parseAddress
+
+
+def parse_args(params) -> argparse.Namespace:
+    """Parses arguments from the command line."""
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--dataFile', type=str, default='data/raw/ACL_035_raw.set',
+                        help='EEGLAB .set or BYB .wav recording to replay')
+    parser.add_argument('--connect', type=str, default='127.0.0.1:8765',
+                        help="'host:port' for TCP or a Unix socket path")
+    parser.add_argument('--start', type=float, default=0, help='replay start (s)')
+    parser.add_argument('--stop', type=float, default=0, help='replay stop (s, 0 for the end)')
+    parser.add_argument('--blockMs', type=int, default=100)
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='multiple of real time (0 sends as fast as possible)')
+    parser.add_argument('--wavScale', type=float, default=1 / 32768,
+                        help='scale applied to .wav samples (int16 full scale to +/-1)')
+    parser.add_argument('--verbose', type=int, default=1)
+
+    args = parser.parse_args(params)
+    return args
+
+
+def openSource(fName, wavScale=1 / 32768):
+    """
+    open a recording for block-wise replay
+    :param fName: EEGLAB .set or BYB .wav file name
+    :param wavScale: scale applied to .wav samples
+    :return: function(start, stop) returning channels x samples, sample rate,
+    number of samples
+    """
+    if fName.endswith('.wav'):
+        from scipy.io import wavfile
+        sampleRate, data = wavfile.read(fName, mmap=True)
+        data = data.reshape(len(data), -1).T  # mono files come back 1-D
+        return (lambda start, stop: data[:, start:stop].astype(np.float32) * wavScale,
+                sampleRate, data.shape[1])
+    from mne.io.eeglab import read_raw_eeglab
+    raw = read_raw_eeglab(input_fname=fName)
+    return (lambda start, stop: raw.get_data(start=start, stop=stop),
+            int(raw.info['sfreq']), raw.n_times)
+
+
+async def replay(args):
+    readBlock, sampleRate, sampleCount = openSource(args.dataFile, args.wavScale)
+    first = int(args.start * sampleRate)
+    last = min(int(args.stop * sampleRate), sampleCount) if args.stop > 0 else sampleCount
+    blockSamples = max(1, int(args.blockMs * sampleRate / 1000))
+
+    kind, host, port = parseAddress(args.connect)
+    if kind == 'tcp':
+        reader, writer = await asyncio.open_connection(host, port)
+    else:
+        reader, writer = await asyncio.open_unix_connection(host)
+
+    async def send():
+        began = time.perf_counter()
+        for start in range(first, last, blockSamples):
+            stop = min(start + blockSamples, last)
+            if args.speed > 0:
+                # hold each block until its last sample would have been acquired
+                due = began + (stop - first) / sampleRate / args.speed
+                await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            writer.write(packFrame(readBlock(start, stop), start))
+            await writer.drain()  # waits here while the service pushes back
+        writer.write_eof()
+        return time.perf_counter() - began
+
+    async def receive():
+        events, summary = [], {}
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if message['type'] == 'event':
+                events.append(message)
+                if args.verbose > 0:
+                    print(f"Event {message['electrode']} at {message['time']:.3f}s "
+                          f"(dissimilarity {message['dissimilarity']:.3f})")
+            elif message['type'] == 'block' and args.verbose > 1:
+                print(f"Block {message['firstSample']}: {message['latencyMs']:.1f}ms "
+                      f"(queue {message['queueDepth']}, dropped {message['dropped']})")
+            elif message['type'] == 'summary':
+                summary = message
+            elif message['type'] == 'error':
+                print(f"Detection service error: {message['message']}")
+        return events, summary
+
+    sendSeconds, (events, summary) = await asyncio.gather(send(), receive())
+    writer.close()
+    print(f"Replayed {(last - first) / sampleRate:.1f}s in {sendSeconds:.1f}s: "
+          f"{len(events)} events, latency mean {summary.get('meanMs', np.nan):.1f}ms "
+          f"p95 {summary.get('p95Ms', np.nan):.1f}ms, {summary.get('dropped', 0)} blocks dropped")
+    return events, summary
+
+
+def main(params):
+    args = parse_args(params)
+    return asyncio.run(replay(args))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
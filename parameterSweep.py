@@ -0,0 +1,310 @@
+import os
+import sys
+import csv
+import time
+import json
+import argparse
+import itertools
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from blinkDection import findBlinks, zeroOutOfRange, massProfile, matrixProfile, slidingStats
+from blinkResults import EventSet
+from plotElectrodeResponses import (getChannels, readRecording, learnTemplate,
+                                    extendWindow, cachedStats, cachedMatrixProfile,
+                                    parseWindows)
+from jitCache import enableKernelCache, DEFAULT_CACHE_DIR
+
+# parameters that can be swept and their defaults when absent from the grid
+SWEEP_DEFAULTS = {
+    'eventDuration': [300],
+    'disThresh': [10],
+    'delta': [0],  # 0 holds the event duration fixed (no dynamic window)
+    'learnWindow': ['707-721'],
+}
+TABLE_COLUMNS = ['eventDuration', 'disThresh', 'delta', 'learnWindow',
+                 'channels', 'events', 'eventsPerMinute', 'meanDissimilarity',
+                 'runtime']
+# shared setup (matrix profile and sliding statistics), reported on its own
+SETUP_COLUMNS = ['eventDuration', 'learnWindow', 'channels', 'runtime']
+
+# recording data shared by the sweep workers (set by _initWorker)
+_SWEEP = {}
+
+
+def parse_args(params) -> argparse.Namespace:
+    """Parses arguments from the command line."""
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('--dataFile', type=str, default='data/raw/ACL_035_raw.set')
+    parser.add_argument('--sampleRate', type=int, default=1000)
+    parser.add_argument('--channels', type=str, default='14 8 1')
+    parser.add_argument('--badChannels', type=str, default='44')
+    parser.add_argument('--findStart', type=int, default=900)
+    parser.add_argument('--findStop', type=int, default=1000)
+    parser.add_argument('--grid', type=str, default='{}',
+                        help='JSON object (or JSON file) mapping eventDuration, '
+                             'disThresh, delta and learnWindow ("start-stop") '
+                             'to lists of values')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', type=str, default='')
+    parser.add_argument('--jitCache', type=str, default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--dtype', choices=['float64', 'float32'], default='float64')
+
+    args = parser.parse_args(params)
+    return args
+
+
+def readGrid(gridString):
+    """
+    read the parameter grid from a JSON string or file and fill in defaults
+    :param gridString: JSON object or the name of a JSON file
+    :return: dict of parameter name to list of values
+    """
+    if os.path.isfile(gridString):
+        with open(gridString, "r") as json_file:
+            grid = json.load(json_file)
+    else:
+        grid = json.loads(gridString)
+    unknown = set(grid) - set(SWEEP_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+    return {name: list(grid.get(name, default)) for name, default in SWEEP_DEFAULTS.items()}
+
+
+def parseWindow(window):
+    """
+    :param window: 'start-stop' in seconds
+    :return: (start, stop)
+    """
+    return parseWindows(window)[0]
+
+
+def buildTasks(grid, channelRows, electLabels):
+    """
+    Split the grid into tasks, one per channel, event duration and learning
+    window.  Each task computes the matrix profile and sliding statistics
+    its configurations (the disThresh and delta values) share and runs the
+    configurations on them in the same worker, so the setup results never
+    travel between processes.
+    :param grid: dict of parameter name to list of values
+    :param channelRows: rows of the shared data to process
+    :param electLabels: electrode label for each row
+    :return: list of tasks ((row, label, eventDuration, learnWindow), [config, ...])
+    """
+    tasks = []
+    for eventDuration, learnWindow in itertools.product(grid['eventDuration'],
+                                                       grid['learnWindow']):
+        for row, label in zip(channelRows, electLabels):
+            configs = [{'eventDuration': eventDuration, 'learnWindow': learnWindow,
+                        'disThresh': disThresh, 'delta': delta}
+                       for disThresh, delta in itertools.product(grid['disThresh'],
+                                                                 grid['delta'])]
+            tasks.append(((row, label, eventDuration, learnWindow), configs))
+    return tasks
+
+
+def _initWorker(data, tLabels, sampleRate, findRange, jitCache):
+    if jitCache.upper() != 'NO':
+        enableKernelCache(jitCache)
+    _SWEEP['data'] = data
+    _SWEEP['tLabels'] = tLabels
+    _SWEEP['sampleRate'] = sampleRate
+    _SWEEP['findRange'] = findRange
+    # load (or compile) the kernels now so no configuration's runtime pays for it
+    warmup = np.random.default_rng(0).normal(size=64)
+    matrixProfile(warmup, 8)
+    massProfile(warmup[:8], warmup, tStats=slidingStats(warmup, 8))
+    massProfile(warmup[:8], warmup)
+
+
+def _taskData(row, learnWindow):
+    data, tLabels, sampleRate = _SWEEP['data'], _SWEEP['tLabels'], _SWEEP['sampleRate']
+    learnStart, learnStop = parseWindow(learnWindow)
+    findStart, findStop = _SWEEP['findRange']
+    return (data[row][learnStart * sampleRate:learnStop * sampleRate],
+            tLabels[learnStart * sampleRate:learnStop * sampleRate],
+            zeroOutOfRange(data[row][findStart * sampleRate:findStop * sampleRate]),
+            tLabels[findStart * sampleRate:findStop * sampleRate])
+
+
+def runSetup(setup):
+    """
+    compute what every configuration of a setup shares: the learning
+    window's matrix profile and the sliding statistics of both ranges
+    :param setup: (row, label, eventDuration, learnWindow)
+    :return: (cache dict for learnTemplate/extendWindow, seconds taken)
+    """
+    row, label, eventDuration, learnWindow = setup
+    sequ, _, findSequ, _ = _taskData(row, learnWindow)
+    tic = time.perf_counter()
+    cache = {}
+    cachedMatrixProfile(cache, sequ, eventDuration)
+    cachedStats(cache, 'learn', sequ, eventDuration)
+    cachedStats(cache, 'find', findSequ, eventDuration)
+    return cache, time.perf_counter() - tic
+
+
+def runConfig(setup, cache, config):
+    """
+    run one configuration on one channel, timing only its own LEARN and FIND
+    work (profiles for extended windows, which depend on delta, included)
+    :param setup: (row, label, eventDuration, learnWindow)
+    :param cache: the setup's cache (entries added here are not kept)
+    :param config: dict of the configuration's parameters
+    :return: result dict
+    """
+    row, label, eventDuration, learnWindow = setup
+    cache = dict(cache)
+    sampleRate = _SWEEP['sampleRate']
+    sequ, learnLabels, findSequ, findLabels = _taskData(row, learnWindow)
+    tic = time.perf_counter()
+    blinkWave, blinks, blinkDis, blinkIXs = (
+        learnTemplate(sequ, learnLabels, eventDuration, sampleRate, label,
+                      disThresh=config['disThresh'], cache=cache))
+    if config['delta'] > 0:
+        signals = {'original': EventSet(blinkWave=blinkWave, blinks=blinks,
+                                        blinksIndecies=blinkIXs,
+                                        dissimilarity=blinkDis,
+                                        duration=eventDuration)}
+        blinkWave = extendWindow(len(blinks), config['delta'], signals,
+                                 eventDuration, sampleRate, sequ, learnLabels,
+                                 label, verbose=0,
+                                 disThresh=config['disThresh'],
+                                 cache=cache)['blinkWave']
+    found, foundDis, _ = findBlinks(blinkWave, findSequ, len(blinkWave) / sampleRate,
+                                    sampleHz=sampleRate, tLabels=findLabels,
+                                    verbose=0, electrode=label,
+                                    disThresh=config['disThresh'],
+                                    tStats=cachedStats(cache, 'find', findSequ, len(blinkWave)))
+    return dict(config, channel=label, events=len(found), dissimilarity=list(foundDis),
+                runtime=time.perf_counter() - tic)
+
+
+def runTask(task):
+    """
+    run a task's setup, then each of its configurations
+    :param task: ((row, label, eventDuration, learnWindow), [config, ...])
+    :return: (seconds the setup took, [result dict, ...])
+    """
+    setup, configs = task
+    # keep the per-configuration chatter of the pipeline out of the table
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        cache, setupSeconds = runSetup(setup)
+        return setupSeconds, [runConfig(setup, cache, config) for config in configs]
+
+
+def summarize(results, findSeconds):
+    """
+    combine the per-channel results into one row per configuration
+    :param results: per-channel, per-configuration result dicts
+    :param findSeconds: length of the FIND range in seconds
+    :return: list of table rows
+    """
+    byConfig = {}
+    for res in results:
+        key = (res['eventDuration'], res['disThresh'], res['delta'], res['learnWindow'])
+        byConfig.setdefault(key, []).append(res)
+    table = []
+    for key, chanResults in byConfig.items():
+        events = np.mean([r['events'] for r in chanResults])
+        dissimilarity = [d for r in chanResults for d in r['dissimilarity']]
+        table.append(dict(zip(TABLE_COLUMNS[:4], key),
+                          channels=len(chanResults),
+                          events=events,
+                          eventsPerMinute=events / (findSeconds / 60),
+                          meanDissimilarity=np.mean(dissimilarity) if dissimilarity else np.nan,
+                          runtime=sum(r['runtime'] for r in chanResults)))
+    table.sort(key=lambda row: tuple(row[c] for c in TABLE_COLUMNS[:4]))
+    return table
+
+
+def summarizeSetup(setups, setupSeconds):
+    """
+    :param setups: (row, label, eventDuration, learnWindow) per task
+    :param setupSeconds: seconds each task's setup took
+    :return: list of table rows (one per event duration and learning window)
+    """
+    byKey = {}
+    for (_, _, eventDuration, learnWindow), seconds in zip(setups, setupSeconds):
+        byKey.setdefault((eventDuration, learnWindow), []).append(seconds)
+    return [dict(zip(SETUP_COLUMNS[:2], key), channels=len(seconds), runtime=sum(seconds))
+            for key, seconds in sorted(byKey.items())]
+
+
+def printTable(table, columns=TABLE_COLUMNS):
+    print(', '.join(columns))
+    for row in table:
+        print(', '.join(f"{row[c]:.3f}" if isinstance(row[c], float) else str(row[c])
+                        for c in columns))
+
+
+def writeTable(table, fName):
+    with open(fName, "w", newline='') as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=TABLE_COLUMNS)
+        writer.writeheader()
+        writer.writerows(table)
+
+
+def sweep(data, tLabels, channelRows, electLabels, grid, sampleRate,
+          findStart, findStop, workers=None, jitCache=DEFAULT_CACHE_DIR):
+    """
+    Fan a parameter grid out over a pool of worker processes.  The recording
+    is loaded once by the caller and each worker receives the selected
+    channels once.  Each task computes the matrix profile and sliding
+    statistics of one channel, event duration and learning window once and
+    runs every configuration on them, so only the results are sent back.
+    :param data: channels x samples data (only channelRows are used)
+    :param tLabels: time labels for the recording
+    :param channelRows: rows of data to process
+    :param electLabels: electrode label for each row
+    :param grid: dict of parameter name to list of values
+    :param sampleRate: samples per second
+    :param findStart: FIND range start (s)
+    :param findStop: FIND range stop (s)
+    :param workers: number of worker processes
+    :param jitCache: compiled kernel cache directory for the workers ('NO' to skip)
+    :return: table rows (one per configuration), setup table rows (one per
+    event duration and learning window)
+    """
+    subset = np.asarray(data[channelRows])
+    tasks = buildTasks(grid, range(len(channelRows)), electLabels)
+    configCount = sum(len(configs) for _, configs in tasks)
+    print(f"Sweeping {configCount // len(channelRows)} configurations x "
+          f"{len(channelRows)} channels ({len(tasks)} tasks) over {workers} workers")
+    # spawn, since forking a parent whose numba threads have already run
+    # leaves the workers unable to exit
+    with ProcessPoolExecutor(max_workers=workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_initWorker,
+                             initargs=(subset, tLabels, sampleRate,
+                                       (findStart, findStop), jitCache)) as pool:
+        setupSeconds, results = zip(*pool.map(runTask, tasks))
+    return (summarize([res for taskResults in results for res in taskResults],
+                      findStop - findStart),
+            summarizeSetup([setup for setup, _ in tasks], setupSeconds))
+
+
+def main(params):
+    args = parse_args(params)
+    grid = readGrid(args.grid)
+    _, allData, tLabels, electLabels = readRecording(args.dataFile, dtype=args.dtype)
+    _, goodChannels = getChannels(False, electLabels, args.channels, args.badChannels)
+    goodIndecies = [electLabels.index(x) for x in goodChannels]
+
+    table, setupTable = sweep(allData, tLabels, goodIndecies, goodChannels, grid,
+                              args.sampleRate, args.findStart, args.findStop,
+                              workers=args.workers, jitCache=args.jitCache)
+    print("Shared setup (matrix profile and sliding statistics, not in the "
+          "configuration runtimes):")
+    printTable(setupTable, SETUP_COLUMNS)
+    printTable(table)
+    if len(args.output) > 1:
+        print(f"Writing sweep table to {args.output}")
+        writeTable(table, args.output)
+    return table
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
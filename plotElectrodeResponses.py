@@ -1,13 +1,19 @@
-import copy
 import sys
 import argparse
 import json
 import numpy as np
-from mne.io.eeglab import read_raw_eeglab, read_epochs_eeglab
-from blinkDection import (findBlinkWave, findBlinks, combineWaves, plotWaves, zeroOutOfRange,
+from blinkDection import (findBlinkWave, findBlinks, findConsensusBlinks, combineWaves, plotWaves, zeroOutOfRange,
                           plotMotifMatchesMultiElectrodes, plotEEGs, plotMotifMatches,
-                          plotSynchedMeanWaves, stratifyForColors,
-                          plotSensorStrengths)
+                          plotSynchedMeanWaves, expandVizWindow,
+                          plotSensorStrengths, slidingStats, matrixProfile,
+                          findBlinkWaveMultiWindow, DETECTION_ENGINES)
+from blinkResults import EventSet, channelOutcomes
+from epochExport import exportEpochs
+from artifactRemoval import cleanRecording
+from findSession import FindSession
+from channelScreening import screenChannels
+from resourcePlanner import planRun, printPlan, readHeader
+from jitCache import enableKernelCache, secondsSinceStart, DEFAULT_CACHE_DIR
 
 
 def getChannels(askUser, electLabels, channelString, badChannelString):
@@ -67,6 +73,19 @@ def getTimes(askUser, learnStartTime, learnStopTime):
     return startTime, endTime
 
 
+def parseWindows(windowString):
+    """
+    parse a space-delimited list of time windows
+    :param windowString: e.g., '707-721 1300-1314' (seconds)
+    :return: [(start, stop), ...]
+    """
+    windows = []
+    for window in windowString.split():
+        start, stop = window.split('-')
+        windows.append((int(start), int(stop)))
+    return windows
+
+
 def parse_args(params) -> argparse.Namespace:
     """Parses arguments from the command line."""
     parser = argparse.ArgumentParser()
@@ -82,9 +101,41 @@ def parse_args(params) -> argparse.Namespace:
     parser.add_argument('--badChannels', type=str, default='44')
     parser.add_argument('--learnStart', type=int, default=707)
     parser.add_argument('--learnStop', type=int, default=721)
+    parser.add_argument('--learnWindows', type=str, default='',
+                        help="space-delimited 'start-stop' windows (s) to learn from; "
+                             "one window replaces --learnStart/--learnStop")
+    parser.add_argument('--learnWorkers', type=int, default=1)
     parser.add_argument('--findStart', type=int, default=900)
     parser.add_argument('--findStop', type=int, default=1000)
     parser.add_argument('--pipeline', choices=['LEARN', 'FIND', 'ALL'], default='all')
+    parser.add_argument('--disThresh', type=float, default=10)
+    parser.add_argument('--delta', type=int, default=30)
+    parser.add_argument('--detection', choices=['CHANNEL', 'CONSENSUS'], default='CHANNEL')
+    parser.add_argument('--consensusMode', choices=['MEAN', 'KOFN'], default='MEAN')
+    parser.add_argument('--consensusK', type=int, default=None)
+    parser.add_argument('--exportEpochs', type=str, default='')
+    parser.add_argument('--epochAlign', choices=['COMMON', 'CHANNEL'], default='COMMON')
+    parser.add_argument('--cleanOutput', type=str, default='')
+    parser.add_argument('--cleanMode', choices=['CHANNEL', 'CONSENSUS'], default='CHANNEL')
+    parser.add_argument('--chunkSeconds', type=int, default=60)
+    parser.add_argument('--jitCache', type=str, default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--dtype', choices=['float64', 'float32'], default='float64')
+    parser.add_argument('--engine', choices=sorted(DETECTION_ENGINES), default='mass',
+                        help='FIND detection engine (LEARN always uses MASS)')
+    parser.add_argument('--minScale', type=float, default=0.5,
+                        help='smallest template scale accepted by the matched filter')
+    parser.add_argument('--dryRun', type=str, default='NO',
+                        help='YES prints the estimated time/memory plan and exits')
+    parser.add_argument('--memLimit', type=float, default=0,
+                        help='memory limit (GB) the planner fits the run into (0: none)')
+    parser.add_argument('--timeBudget', type=float, default=0,
+                        help='run time (s) the planner fits the run into (0: none)')
+    parser.add_argument('--screenChannels', type=str, default='YES',
+                        help='YES drops flat, clipped, noisy or line-dominated channels '
+                             'before LEARN (see channelScreening.SCREEN_LIMITS)')
+    parser.add_argument('--lineFreq', type=float, default=60)
+    parser.add_argument('--findSession', type=str, default='',
+                        help='.npz file keeping FIND distance profiles between runs')
 
     args = parser.parse_args(params)
     return args
@@ -102,6 +153,9 @@ def writeTemplateFile(dataIn, fName):
     for chan in dataIn.keys():
         dataOut[chan] = dict()
         for vers in dataIn[chan].keys():
+            if isinstance(dataIn[chan][vers], EventSet):
+                dataOut[chan][vers] = dataIn[chan][vers].toJSON()
+                continue
             dataOut[chan][vers] = dict()
             for elem in dataIn[chan][vers].keys():
                 if isinstance(dataIn[chan][vers][elem], np.ndarray):
@@ -116,11 +170,13 @@ def writeTemplateFile(dataIn, fName):
     return
 
 
-def readTemplateFile(fName):
+def readTemplateFile(fName, dtype=None):
     """
-    read the JSON file and convert the 'blinkWave' data into numpy array
+    read the JSON file and convert each channel/version into an EventSet
+    of numpy arrays
     :param fName: the name of the file to read
-    :return: the data read from the file
+    :param dtype: dtype of the template waves (default: float64)
+    :return: the data read from the file ([chan][vers][elem] access)
     """
     with open(fName, "r") as json_file:
         dataIn = json.load(json_file)
@@ -129,26 +185,178 @@ def readTemplateFile(fName):
         chan_I = int(chan)
         dataOut[chan_I] = dict()
         for vers in dataIn[chan].keys():
-            dataOut[chan_I][vers] = dict()
-            for elem in dataIn[chan][vers].keys():
-                if elem == 'blinkWave':
-                    dataOut[chan_I][vers][elem] = np.array(dataIn[chan][vers][elem])
-                else:
-                    dataOut[chan_I][vers][elem] = dataIn[chan][vers][elem]
+            dataOut[chan_I][vers] = EventSet.fromJSON(dataIn[chan][vers], dtype=dtype)
     return dataOut
 
 
+def readRecording(fName, dtype=np.float64, chunkSeconds=60):
+    """
+    read an EEGLAB recording
+    :param fName: the name of the .set file to read
+    :param dtype: dtype of the returned data, float64 or float32 (to halve memory)
+    :param chunkSeconds: length of the chunks read when converting the dtype
+    :return: raw recording, data (channels x samples), time labels, electrode labels
+    """
+    if np.dtype(dtype) not in (np.float64, np.float32):
+        # samples are volts, so an integer dtype would truncate them to 0
+        raise ValueError(f"Recordings are read as float64 or float32, not {np.dtype(dtype)}")
+    from mne.io.eeglab import read_raw_eeglab
+    testRaw = read_raw_eeglab(input_fname=fName, preload=False)
+    if np.dtype(dtype) == np.float64:
+        allData = testRaw.get_data()
+    else:
+        # fill the reduced precision array a chunk at a time so that a float64
+        # copy of the whole recording never exists
+        allData = np.empty((len(testRaw.ch_names), testRaw.n_times), dtype=dtype)
+        step = int(chunkSeconds * testRaw.info['sfreq'])
+        for start in range(0, testRaw.n_times, step):
+            stop = min(start + step, testRaw.n_times)
+            allData[:, start:stop] = testRaw.get_data(start=start, stop=stop)
+    tLabels = testRaw.times
+    electLabels = testRaw.ch_names
+    return testRaw, allData, tLabels, electLabels
+
+
+def cachedStats(cache, key, sequ, m):
+    """
+    sliding statistics of sequ for templates of length m, computed once per
+    (key, m) when a cache dictionary is provided
+    :param cache: dict shared across calls on the same data (or None)
+    :param key: name of the data the statistics belong to (e.g., 'learn')
+    :param sequ: time series data
+    :param m: template length in samples
+    :return: slidingStats(sequ, m) or None when not caching
+    """
+    if cache is None:
+        return None
+    if (key, m) not in cache:
+        cache[(key, m)] = slidingStats(sequ, m)
+    return cache[(key, m)]
+
+
+def cachedMatrixProfile(cache, sequ, m):
+    """
+    self-join matrix profile of the learning data, computed once per m when a
+    cache dictionary is provided
+    :param cache: dict shared across calls on the same data (or None)
+    :param sequ: time series data
+    :param m: template length in samples
+    :return: matrixProfile(sequ, m) or None when not caching
+    """
+    if cache is None:
+        return None
+    if ('stump', m) not in cache:
+        cache[('stump', m)] = matrixProfile(sequ, m)
+    return cache[('stump', m)]
+
+
+def learnTemplate(sequ, timeLabels, blinkDurationMS, sampleRate, srcLabel,
+                  verbose=0, disThresh=10, cache=None):
+    """
+    Learn an event template from one channel's learning window: find the best
+    duplicated wave, collect its matches, average them into a new template
+    and collect the matches of that template.
+    :param sequ: learning window data for the channel
+    :param timeLabels: time labels for the learning window
+    :param blinkDurationMS: event duration in samples
+    :param sampleRate: samples per second
+    :param srcLabel: electrode label
+    :param verbose: how verbose (0-10) output should be
+    :param disThresh: dissimilarity threshold for accepting an event
+    :param cache: dict of precomputed statistics shared across calls on sequ
+    :return: template wave, event times, dissimilarities, event indices
+    """
+    blinkDuration = blinkDurationMS / sampleRate  # event duration in seconds
+    windowSeconds = len(sequ) / sampleRate
+    # Find initial signal event wave as best duplicated sequence.
+    blinkWave = findBlinkWave(sequ, blinkDuration,
+                              sampleHz=sampleRate,
+                              tLabels=timeLabels,
+                              verbose=verbose, electrode=srcLabel,
+                              matrixProf=cachedMatrixProfile(cache, sequ, blinkDurationMS))
+
+    # Find all instances of this signal event within the time range
+    blinks, blinkDis, startIndecies = (
+        findBlinks(blinkWave, sequ, blinkDuration,
+                   sampleHz=sampleRate,
+                   tLabels=timeLabels,
+                   verbose=verbose + 1 if verbose else 0,
+                   electrode=srcLabel, disThresh=disThresh,
+                   tStats=cachedStats(cache, 'learn', sequ, blinkDurationMS)))
+    newBlinkWave = combineWaves([sequ[start: start + blinkDurationMS]
+                                 for start in startIndecies])
+    print(f"Events per minute: {len(blinks)/(windowSeconds/60)}")
+
+    # Try again with new updated wave
+    print(f"Repeat event discovery with wave generated from {len(blinks)} "
+          f"detected waves.")
+
+    blinks1, blinksDis1, blinkIXs1 = (
+        findBlinks(newBlinkWave, sequ, blinkDuration, sampleHz=sampleRate,
+                   tLabels=timeLabels,
+                   verbose=verbose + 2 if verbose else 0,
+                   electrode=srcLabel, disThresh=disThresh,
+                   tStats=cachedStats(cache, 'learn', sequ, blinkDurationMS)))
+    return newBlinkWave, blinks1, blinksDis1, blinkIXs1
+
+
+def learnTemplateMultiWindow(windows, windowLabels, offsets, blinkDurationMS,
+                             sampleRate, srcLabel, verbose=0, disThresh=10,
+                             workers=1):
+    """
+    Learn an event template from several disjoint learning windows of one
+    channel: find the motif recurring across the most windows with AB-joins,
+    collect its matches in every window, average them into a new template and
+    collect the matches of that template.
+    :param windows: list of learning window data for the channel
+    :param windowLabels: list of time labels for each window
+    :param offsets: sample offset of each window from the first window's start
+    :param blinkDurationMS: event duration in samples
+    :param sampleRate: samples per second
+    :param srcLabel: electrode label
+    :param verbose: how verbose (0-10) output should be
+    :param disThresh: dissimilarity threshold for accepting an event
+    :param workers: number of processes used for the AB-joins
+    :return: template wave, event times, dissimilarities, event indices
+    (relative to the first window's start)
+    """
+    blinkDuration = blinkDurationMS / sampleRate  # event duration in seconds
+    windowSeconds = sum(len(sequ) for sequ in windows) / sampleRate
+    blinkWave, _ = findBlinkWaveMultiWindow(windows, blinkDuration, sampleHz=sampleRate,
+                                            verbose=verbose, electrode=srcLabel,
+                                            disThresh=disThresh, workers=workers)
+    matches = []
+    for sequ, timeLabels in zip(windows, windowLabels):
+        _, _, startIndecies = findBlinks(blinkWave, sequ, blinkDuration,
+                                         sampleHz=sampleRate, tLabels=timeLabels,
+                                         verbose=verbose + 1 if verbose else 0,
+                                         electrode=srcLabel, disThresh=disThresh)
+        matches.extend(sequ[start: start + blinkDurationMS] for start in startIndecies)
+    newBlinkWave = combineWaves(matches)
+    print(f"Events per minute: {len(matches)/(windowSeconds/60)}")
+
+    # Try again with new updated wave
+    print(f"Repeat event discovery with wave generated from {len(matches)} "
+          f"detected waves in {len(windows)} windows.")
+    blinks1, blinksDis1, blinkIXs1 = [], [], []
+    for sequ, timeLabels, offset in zip(windows, windowLabels, offsets):
+        blinks, blinkDis, blinkIXs = (
+            findBlinks(newBlinkWave, sequ, blinkDuration, sampleHz=sampleRate,
+                       tLabels=timeLabels,
+                       verbose=verbose + 2 if verbose else 0,
+                       electrode=srcLabel, disThresh=disThresh))
+        blinks1.extend(blinks)
+        blinksDis1.extend(blinkDis)
+        blinkIXs1.extend(ix + offset for ix in blinkIXs)
+    return newBlinkWave, blinks1, blinksDis1, blinkIXs1
+
+
 def extendWindow(expectedBlinks, delta, signals, signalDuration, sampleRate,
-                 data, timeLabels, srcLabel, verbose):
+                 data, timeLabels, srcLabel, verbose, disThresh=10, cache=None):
     # EXTEND window until it alters the number of blinks discovered
     #expectedBlinks = len(blinks1)
     blinkCount = expectedBlinks
-    signalsExt = dict()
-    signalsExt['blinks'] = copy.deepcopy(signals['original']['blinks'])
-    signalsExt['blinksIndecies'] = copy.deepcopy(signals['original']['blinksIndecies'])
-    signalsExt['dissimilarity'] = copy.deepcopy(signals['original']['dissimilarity'])
-    signalsExt['blinkWave'] = signals['original']['blinkWave']
-    signalsExt['duration'] = signals['original']['duration']
+    signalsExt = signals['original'].snapshot()
     # Expanding the duration of the target signal only makes sense if there
     # is more than one signal already detected because expanding the
     # duration of the target decreases the likelihood of multiple signals
@@ -165,13 +373,16 @@ def extendWindow(expectedBlinks, delta, signals, signalDuration, sampleRate,
             blinkWaveW0 = findBlinkWave(sequ, blinkDuration,
                                         sampleHz=sampleRate,
                                         tLabels=timeLabels,
-                                        verbose=0, electrode=srcLabel)
+                                        verbose=0, electrode=srcLabel,
+                                        matrixProf=cachedMatrixProfile(cache, sequ, waveDuration))
 
             blinksW0, blinkDisW0, _ = findBlinks(blinkWaveW0, sequ, blinkDuration,
                                                  sampleHz=sampleRate,
                                                  tLabels=timeLabels,
                                                  verbose=0,
-                                                 electrode=srcLabel)
+                                                 electrode=srcLabel,
+                                                 disThresh=disThresh,
+                                                 tStats=cachedStats(cache, 'learn', sequ, waveDuration))
             startTime, endTime = timeLabels[0], timeLabels[-1]
             startIndecies = [np.where(timeLabels == b)[0][0] for b in blinksW0]
             newBlinkWave = combineWaves([sequ[start: start + waveDuration]
@@ -186,14 +397,16 @@ def extendWindow(expectedBlinks, delta, signals, signalDuration, sampleRate,
                                                                sampleHz=sampleRate,
                                                                tLabels=timeLabels,
                                                                verbose=verbose,
-                                                               electrode=srcLabel)
+                                                               electrode=srcLabel,
+                                                               disThresh=disThresh,
+                                                               tStats=cachedStats(cache, 'learn', sequ, waveDuration))
                 blinkCount = len(blinksW2)
                 if blinkCount == expectedBlinks:
-                    signalsExt['blinks'] = copy.deepcopy(blinksW2)
-                    signalsExt['blinksIndecies'] = copy.deepcopy(blinksIXsW2)
-                    signalsExt['dissimilarity'] = copy.deepcopy(blinkDisW2)
-                    signalsExt['blinkWave'] = copy.deepcopy(newBlinkWave)
-                    signalsExt['duration'] = waveDuration
+                    signalsExt = EventSet(blinks=blinksW2,
+                                          blinksIndecies=blinksIXsW2,
+                                          dissimilarity=blinkDisW2,
+                                          blinkWave=newBlinkWave,
+                                          duration=waveDuration)
                 else:
                     print(f"{srcLabel} Stop Extension: Signal count changed from {expectedBlinks} to {blinkCount}.")
             else:
@@ -205,7 +418,9 @@ def extendWindow(expectedBlinks, delta, signals, signalDuration, sampleRate,
 def FindEvents(signals, askUser, findStartTime, findStopTime,
                tLabels, sampleRate,
                data, AllElect,
-               electLabels, goodIndecies, blinkDurationMS):
+               electLabels, goodIndecies, blinkDurationMS,
+               detection='CHANNEL', consensusMode='MEAN', consensusK=None,
+               disThresh=10, session=None, engine='mass', minScale=0.5):
     ### apply wave detection to full range of data
     print("Going Big (longer timeline)")
     print(f"Data time range is from 0 to {int(len(tLabels)/sampleRate)} seconds")
@@ -219,20 +434,57 @@ def FindEvents(signals, askUser, findStartTime, findStopTime,
         plotEEGs([cleanData[ix] for ix, electIX in enumerate(goodIndecies)],
                  tLabels[startIX:endIX],
                  [electLabels[electIX] for electIX in goodIndecies])
+    if session is not None:
+        # reuse the distance profiles of earlier runs over overlapping ranges
+        profiles = [session.distanceProfile(electIX, signals[electIX]['original']['blinkWave'],
+                                            data[electIX], startIX, endIX,
+                                            engine=engine, minScale=minScale)
+                    for electIX in goodIndecies]
+    else:
+        profiles = [None] * len(goodIndecies)
 
-    for ix, electIX in enumerate(goodIndecies):
-        sequ = np.array(cleanData[ix], dtype=np.float64)
+    if detection == 'CONSENSUS' and len(goodIndecies) > 1:
+        # one selection pass over the combined profile of every channel
+        print(f"Consensus ({consensusMode}) detection across {len(goodIndecies)} channels")
         blinksBig, blinksDisBig, blinkIXsBig = (
-            findBlinks(signals[electIX]['original']['blinkWave'],
-                       sequ, blinkDuration, sampleHz=sampleRate,
-                       tLabels=tLabels[startIX:endIX],  verbose=7 if not AllElect else 0, electrode=electLabels[electIX]))
-        signals[electIX]['Big']['blinkWave'] = copy.deepcopy(signals[electIX]['original']['blinkWave'])
-        signals[electIX]['Big']['blinks'] = blinksBig
-        signals[electIX]['Big']['blinksIndecies'] = blinkIXsBig
-        signals[electIX]['Big']['dissimilarity'] = blinksDisBig
-        signals[electIX]['Big']['duration'] = blinkDurationMS
+            findConsensusBlinks([signals[electIX]['original']['blinkWave'] for electIX in goodIndecies],
+                                [np.asarray(cleanData[ix]) for ix in range(len(goodIndecies))],
+                                blinkDuration, sampleHz=sampleRate,
+                                tLabels=tLabels[startIX:endIX], verbose=7 if not AllElect else 0,
+                                electrodes=[electLabels[electIX] for electIX in goodIndecies],
+                                mode=consensusMode, k=consensusK, disThresh=disThresh,
+                                distanceProfiles=profiles if session is not None else None,
+                                engine=engine, minScale=minScale))
+        # every channel shares the same (read-only) event arrays
+        shared = EventSet(blinks=blinksBig, blinksIndecies=blinkIXsBig)
+        for ix, electIX in enumerate(goodIndecies):
+            signals[electIX]['Big'] = shared.snapshot()
+            signals[electIX]['Big']['blinkWave'] = signals[electIX]['original']['blinkWave']
+            signals[electIX]['Big']['dissimilarity'] = blinksDisBig[ix]
+            signals[electIX]['Big']['duration'] = blinkDurationMS
         print(f"{len(blinksBig)} Blinks per minute: {len(blinksBig)/((endTime-startTime)/60)}")
-    if len(goodIndecies) == 1:
+    else:
+        for ix, electIX in enumerate(goodIndecies):
+            sequ = np.asarray(cleanData[ix])
+            blinksBig, blinksDisBig, blinkIXsBig = (
+                findBlinks(signals[electIX]['original']['blinkWave'],
+                           sequ, blinkDuration, sampleHz=sampleRate,
+                           tLabels=tLabels[startIX:endIX],  verbose=7 if not AllElect else 0, electrode=electLabels[electIX],
+                           disThresh=disThresh, distanceProfile=profiles[ix],
+                           engine=engine, minScale=minScale))
+            signals[electIX]['Big'] = EventSet(blinkWave=signals[electIX]['original']['blinkWave'],
+                                               blinks=blinksBig,
+                                               blinksIndecies=blinkIXsBig,
+                                               dissimilarity=blinksDisBig,
+                                               duration=blinkDurationMS)
+            print(f"{len(blinksBig)} Blinks per minute: {len(blinksBig)/((endTime-startTime)/60)}")
+    waveRespMetrics = []
+    empty = [electLabels[electIX] for electIX in goodIndecies
+             if len(signals[electIX]['Big']['blinksIndecies']) == 0]
+    if empty:
+        # the approximate engines may find nothing above their threshold
+        print(f"No events found on {', '.join(empty)}; skipping the match plots")
+    elif len(goodIndecies) == 1:
         electIX = goodIndecies[0]
         plotMotifMatches(cleanData[0], signals[electIX]['Big']['blinksIndecies'],
                          blinkDurationMS,
@@ -256,12 +508,57 @@ def FindEvents(signals, askUser, findStartTime, findStopTime,
 
     return signals, waveRespMetrics
 
+def exportFoundEpochs(signals, data, tLabels, goodIndecies, electLabels,
+                      blinkDurationMS, sampleRate, fName, align='COMMON'):
+    """
+    write the windows around the events found by FindEvents to an epoch file
+    :param signals: detection results ([chan]['Big'][elem])
+    :param data: channels x samples recording data
+    :param tLabels: time labels for the full recording
+    :param goodIndecies: channel indices to export
+    :param electLabels: list of string electrode labels (e.g., 'E1')
+    :param blinkDurationMS: event duration in samples
+    :param sampleRate: samples per second
+    :param fName: name of the .npy file to write
+    :param align: 'COMMON' to use the shared windows from expandVizWindow,
+    'CHANNEL' to use each channel's own event indices
+    :return: shape of the tensor written
+    """
+    # event times are recording times, so recover absolute sample indices
+    starts = [np.searchsorted(tLabels, signals[electIX]['Big']['blinks'])
+              for electIX in goodIndecies]
+    labels = [electLabels[electIX] for electIX in goodIndecies]
+    if align == 'COMMON':
+        commonStarts, commonPreWidth, commonWwidth = expandVizWindow(starts, blinkDurationMS, labels)
+        return exportEpochs(data, goodIndecies, commonStarts, commonPreWidth,
+                            commonWwidth, fName, channelLabels=labels,
+                            sampleRate=sampleRate)
+    return exportEpochs(data, goodIndecies, starts, 0, blinkDurationMS, fName,
+                        channelLabels=labels, sampleRate=sampleRate)
+
+
 def main(params):
 
     # incorporate user's parameters
     args = parse_args(params)
-    fnameSetRaw = args.dataFile
     askUser = args.interactive.upper() == 'YES'
+    # ask for the data file first so a run plan describes the file that is read
+    if askUser:
+        fname = input(f"Name of the data file (default: {args.dataFile}? ")
+        if len(fname) > 1:
+            args.dataFile = fname
+    if args.dryRun.upper() == 'YES' or args.memLimit > 0 or args.timeBudget > 0:
+        # estimate the run from the header and fit it to the given limits
+        plan = planRun(args, readHeader(args.dataFile))
+        printPlan(plan)
+        if args.dryRun.upper() == 'YES':
+            return
+        for name, value in plan['choices'].items():
+            setattr(args, name, value)
+    if args.jitCache.upper() != 'NO':
+        # load compiled stumpy kernels from disk instead of JIT compiling them
+        enableKernelCache(args.jitCache)
+    fnameSetRaw = args.dataFile
     dynamicWindow = args.dynamicWindow.upper() == 'YES'
     sampleRate = args.sampleRate
     blinkDurationMS = args.eventDuration
@@ -276,12 +573,32 @@ def main(params):
     learn = pipeline in {'LEARN', 'ALL'}
     readTemplate = args.readTemplate
     writeTemplate = args.writeTemplate
+    detection = args.detection
+    consensusMode = args.consensusMode
+    consensusK = args.consensusK
+    epochFile = args.exportEpochs
+    epochAlign = args.epochAlign
+    disThresh = args.disThresh
+    learnWindows = parseWindows(args.learnWindows)
+    if len(learnWindows) == 1:
+        learnStartTime, learnStopTime = learnWindows[0]
+    learnWorkers = args.learnWorkers
+    if dynamicWindow and len(learnWindows) > 1:
+        # extending the window re-runs the self-join over the whole span
+        print("dynamicWindow is not applied when learning from multiple windows.")
+        dynamicWindow = False
+    cleanFile = args.cleanOutput
+    cleanMode = args.cleanMode
+    chunkSeconds = args.chunkSeconds
+    dtype = np.dtype(args.dtype)
+    delta = args.delta
+    sessionFile = args.findSession
+    engine = args.engine
+    minScale = args.minScale
+    screen = args.screenChannels.upper() == 'YES'
+    lineFreq = args.lineFreq
 
     # Read data file and gather data values, timeframe and electrode labels
-    if askUser:
-        fname = input(f"Name of the data file (default: {fnameSetRaw}? ")
-        if len(fname) > 1:
-            fnameSetRaw = fname
     if askUser:
         fname = input(f"Name of the data file (default: {readTemplate}? ")
         if len(fname) > 1:
@@ -290,20 +607,38 @@ def main(params):
         print(f"No template signal wave defined.")
         print("Either a signal wave template file is needed when skipping the learning phase. ")
 
-    testRaw = read_raw_eeglab(input_fname=fnameSetRaw)
-    allData = testRaw.get_data()
-    tLabels = testRaw.times
-    electLabels = testRaw.ch_names
+    testRaw, allData, tLabels, electLabels = readRecording(fnameSetRaw, dtype=dtype)
     print(f"{len(electLabels)} Electrode labels found: {electLabels}")
     print(f"{len(tLabels)} Time labels found: {tLabels}")
 
     AllElect, goodChannels = getChannels(askUser, electLabels,
                                          channelString, badChannelString)
     goodIndecies = [electLabels.index(x) for x in goodChannels]
+    if screen:
+        # drop unusable channels before any matrix profile work is spent on them
+        # the channels named before ALL (or all of them without ALL) are the
+        # ones the events are meant to be found on
+        named = ["E" + ch for ch in channelString.split(' ') if ch.upper() != 'ALL']
+        targets = [electIX for electIX in goodIndecies
+                   if not AllElect or electLabels[electIX] in named]
+        goodIndecies, _ = screenChannels(allData, goodIndecies, electLabels,
+                                         sampleRate=sampleRate, lineFreq=lineFreq,
+                                         chunkSeconds=chunkSeconds, targets=targets)
+        goodChannels = [electLabels[electIX] for electIX in goodIndecies]
+        if len(goodIndecies) == 0:
+            print("No channels passed screening.")
+            return
 
     waveDuration = blinkDurationMS
     print(f"Sample Rate: {sampleRate}    temporal window (ms): {waveDuration}    ")
-    startTime, endTime = getTimes(askUser, learnStartTime, learnStopTime)
+    if len(learnWindows) > 1:
+        # the learning results are reported over the span of the windows
+        startTime = min(start for start, _ in learnWindows)
+        endTime = max(stop for _, stop in learnWindows)
+        learnSeconds = sum(stop - start for start, stop in learnWindows)
+    else:
+        startTime, endTime = getTimes(askUser, learnStartTime, learnStopTime)
+        learnSeconds = endTime - startTime
     startIX = startTime * sampleRate
     endIX = endTime * sampleRate
 
@@ -313,57 +648,44 @@ def main(params):
                  tLabels[startIX:endIX],
                  [electLabels[electIX] for electIX in goodIndecies])
 
-    blinkDuration = blinkDurationMS / sampleRate  # event duration in sample count
     if learn:
         blinkOutcomes = {}
         for electIX in goodIndecies:
             print(f"\n*** Processing electrode {electLabels[electIX]}")
-            blinkOutcomes[electIX] = {
-                'original': {},
-                'extended': {},
-                'Big': {}
-            }
-
-            # grab limited temporal window
-            sequ = allData[electIX][startTime * sampleRate:endTime * sampleRate]
-            # Find initial signal event wave as best duplicated sequence.
-            blinkWave = findBlinkWave(sequ, blinkDuration,
-                                      sampleHz=sampleRate,
-                                      tLabels=tLabels[startTime*1000:endTime*1000],
-                                      verbose=2 if not AllElect else 0, electrode=electLabels[electIX])
-
-            # Find all instances of this signal event within the time range
-            blinks, blinkDis, _ = (
-                findBlinks(blinkWave, sequ, blinkDuration,
-                           sampleHz=sampleRate,
-                           tLabels=tLabels[startTime*1000:endTime*1000],
-                           verbose=3 if not AllElect else 0,
-                           electrode=electLabels[electIX]))
-            startIndecies = [np.where(tLabels == b)[0][0] - (startTime*1000) for b in blinks]
-            newBlinkWave = combineWaves([sequ[start: start + blinkDurationMS]
-                                         for start in startIndecies])
-            print(f"Events per minute: {len(blinks)/((endTime-startTime)/60)}")
-
-            # Try again with new updated wave
-            print(f"Repeat event discovery with wave generated from {len(blinks)} "
-                  f"detected waves.")
-
-            blinks1, blinksDis1, blinkIXs1 = (
-                findBlinks(newBlinkWave, sequ, blinkDuration, sampleHz=sampleRate,
-                           tLabels=tLabels[startTime*1000:endTime*1000],
-                           verbose=4 if not AllElect else 0,
-                           electrode=electLabels[electIX]))
-            blinkOutcomes[electIX]['original']['blinkWave'] = copy.deepcopy(newBlinkWave)
-            blinkOutcomes[electIX]['original']['blinks'] = blinks1
-            blinkOutcomes[electIX]['original']['blinksIndecies'] = blinkIXs1
-            blinkOutcomes[electIX]['original']['dissimilarity'] = blinksDis1
-            blinkOutcomes[electIX]['original']['duration'] = blinkDurationMS
+            blinkOutcomes[electIX] = channelOutcomes()
+
+            if len(learnWindows) > 1:
+                # AB-join several short windows instead of one long self-join
+                newBlinkWave, blinks1, blinksDis1, blinkIXs1 = (
+                    learnTemplateMultiWindow([allData[electIX][start * sampleRate:stop * sampleRate]
+                                              for start, stop in learnWindows],
+                                             [tLabels[start * sampleRate:stop * sampleRate]
+                                              for start, stop in learnWindows],
+                                             [(start - startTime) * sampleRate
+                                              for start, _ in learnWindows],
+                                             blinkDurationMS, sampleRate, electLabels[electIX],
+                                             verbose=2 if not AllElect else 0,
+                                             disThresh=disThresh, workers=learnWorkers))
+            else:
+                # grab limited temporal window
+                sequ = allData[electIX][startTime * sampleRate:endTime * sampleRate]
+                newBlinkWave, blinks1, blinksDis1, blinkIXs1 = (
+                    learnTemplate(sequ, tLabels[startTime*1000:endTime*1000],
+                                  blinkDurationMS, sampleRate, electLabels[electIX],
+                                  verbose=2 if not AllElect else 0,
+                                  disThresh=disThresh))
+            blinkOutcomes[electIX]['original'] = EventSet(blinkWave=newBlinkWave,
+                                                          blinks=blinks1,
+                                                          blinksIndecies=blinkIXs1,
+                                                          dissimilarity=blinksDis1,
+                                                          duration=blinkDurationMS)
+            if electIX == goodIndecies[0]:
+                print(f"Time from process start to first result: {secondsSinceStart():.2f}s")
             print(f"# {electLabels[electIX]} Blinks per minute ({len(blinks1)} "
-                  f"blinks): {len(blinks1)/((endTime-startTime)/60)}")
+                  f"blinks): {len(blinks1)/(learnSeconds/60)}")
 
             if dynamicWindow:
                 # EXTEND window until it alters the number of blinks discovered
-                delta = 30
                 print(f"The initial time window is being extended from a time "
                       f"window of {blinkDurationMS} by steps of "
                       f"{delta} ms until it alters the number of blinks...")
@@ -373,7 +695,8 @@ def main(params):
                                  allData[electIX][startTime * sampleRate:endTime * sampleRate],
                                  tLabels[startTime * 1000:endTime * 1000],
                                  electLabels[electIX],
-                                 verbose=3 if not AllElect else 0
+                                 verbose=3 if not AllElect else 0,
+                                 disThresh=disThresh
                                  ))
                 if not AllElect:
                     plotWaves([blinkOutcomes[electIX]['extended']['blinkWave']],
@@ -439,19 +762,45 @@ def main(params):
                              electrodes=[electLabels[electIX] for electIX in goodIndecies])
     else:
         # Open the JSON file and load its contents
-        blinkOutcomes = readTemplateFile(readTemplate)
+        blinkOutcomes = readTemplateFile(readTemplate, dtype=dtype)
 
     if doFindEvents:
         ### apply wave detection to full range of data
+        session = FindSession(sessionFile, fnameSetRaw) if len(sessionFile) > 1 else None
         blinkOutcomes, waveRespMetrics = FindEvents(blinkOutcomes, askUser, findStartTime, findStopTime,
                                    tLabels, sampleRate,
                                    allData, AllElect,
-                                   electLabels, goodIndecies, blinkDurationMS)
+                                   electLabels, goodIndecies, blinkDurationMS,
+                                   detection=detection, consensusMode=consensusMode,
+                                   consensusK=consensusK, disThresh=disThresh,
+                                   session=session, engine=engine, minScale=minScale)
+        if session is not None:
+            session.save()
+        if not learn:
+            print(f"Time from process start to first result: {secondsSinceStart():.2f}s")
+        if len(epochFile) > 1:
+            print(f"Exporting aligned event windows to {epochFile}")
+            exportFoundEpochs(blinkOutcomes, allData, tLabels, goodIndecies,
+                              electLabels, blinkDurationMS, sampleRate,
+                              epochFile, epochAlign)
+        if len(cleanFile) > 1:
+            print(f"Removing detected events from the recording ({cleanMode})")
+            # cleaning reads the recording back from disk a chunk at a time
+            # (testRaw is not preloaded), so release the in-memory copy first
+            allData = None
+            cleanRecording(testRaw,
+                           [blinkOutcomes[electIX]['Big']['blinkWave'] for electIX in goodIndecies],
+                           [np.searchsorted(tLabels, blinkOutcomes[electIX]['Big']['blinks'])
+                            for electIX in goodIndecies],
+                           cleanFile, goodIndecies, mode=cleanMode,
+                           sampleRate=sampleRate, chunkSeconds=chunkSeconds,
+                           dtype=dtype)
     if len(writeTemplate) > 1:
         print(f"Writing wave templates to {writeTemplate}")
         writeTemplateFile(blinkOutcomes, writeTemplate)
-    plotSensorStrengths(goodChannels, waveRespMetrics, electLabels,
-                        testRaw.set_montage, testRaw.info)
+    if waveRespMetrics:
+        plotSensorStrengths(goodChannels, waveRespMetrics, electLabels,
+                            testRaw.set_montage, testRaw.info)
     print("done")
     return
 
@@ -0,0 +1,238 @@
+import os
+import sys
+import time
+import argparse
+import itertools
+import numpy as np
+
+# Rough per-operation costs on one core, measured with the stumpy kernels
+# loaded from the JIT cache.  calibrate() re-measures them on this machine.
+PLAN_COSTS = {
+    'stumpSeconds': 3.5e-9,  # per (subsequence pair), divided over the cores
+    'stumpBytes': 300,  # per subsequence: n x 4 object array of boxed values
+    'massSeconds': 1.7e-6,  # per sample of the searched series
+    'massBytes': 57,
+    'matched-filterSeconds': 4e-8,
+    'matched-filterBytes': 35,
+    'hybridSeconds': 6.5e-8,
+    'hybridBytes': 48,
+    'readSeconds': 5e-9,  # per sample per channel read from the .set/.fdt
+    'screenSeconds': 2e-8,  # per sample per channel screened
+    'figureSeconds': 0.5,  # fixed cost of drawing one figure
+    'plotSeconds': 2e-8,  # per plotted sample (decimated to the axes)
+}
+# detection engines from exact to most approximate (see DETECTION_ENGINES)
+ENGINE_ORDER = ['mass', 'hybrid', 'matched-filter']
+# extension steps assumed for dynamicWindow (it stops when the count changes)
+EXTEND_STEPS = 3
+CHUNK_CHOICES = [60, 30, 10, 5, 1]  # seconds
+
+
+def readHeader(fName):
+    """
+    read a recording's header without loading any samples
+    :param fName: EEGLAB .set file name
+    :return: electrode labels, sample rate, number of samples
+    """
+    from mne.io.eeglab import read_raw_eeglab
+    raw = read_raw_eeglab(input_fname=fName, preload=False)
+    return raw.ch_names, raw.info['sfreq'], raw.n_times
+
+
+def calibrate(costs=PLAN_COSTS, m=300):
+    """
+    re-measure the stump and distance profile costs on this machine
+    :param costs: dict of costs to start from
+    :param m: template length used for the measurement
+    :return: dict of costs
+    """
+    import stumpy
+    from blinkDection import DETECTION_ENGINES
+    costs = dict(costs)
+    series = np.random.default_rng(0).normal(size=200000)
+    stumpy.stump(series[:2 * m], m)  # compile (or load) before timing
+    n = 8000
+    tic = time.perf_counter()
+    stumpy.stump(series[:n], m)
+    costs['stumpSeconds'] = (time.perf_counter() - tic) * (os.cpu_count() or 1) / (n - m + 1) ** 2
+    for engine, profileFunc in DETECTION_ENGINES.items():
+        profileFunc(series[:m], series[:4 * m])
+        tic = time.perf_counter()
+        profileFunc(series[:m], series)
+        costs[f"{engine}Seconds"] = (time.perf_counter() - tic) / len(series)
+    return costs
+
+
+def learnCost(windowSamples, m, costs, cores, workers=1):
+    """
+    :param windowSamples: samples in each learning window
+    :param m: template length
+    :return: (seconds, peak bytes) of learning one channel's template
+    """
+    if len(windowSamples) > 1:
+        # findBlinkWaveMultiWindow AB-joins every pair of windows, once per direction
+        pairs = list(itertools.combinations(windowSamples, 2))
+        seconds = costs['stumpSeconds'] * sum(2 * a * b for a, b in pairs) / cores
+        peak = costs['stumpBytes'] * max(windowSamples) * min(workers, len(pairs))
+    else:
+        n = max(windowSamples[0] - m + 1, 1)
+        seconds = costs['stumpSeconds'] * n * n / cores
+        peak = costs['stumpBytes'] * n
+    total = sum(windowSamples)
+    # two MASS passes (first template, then the averaged one)
+    seconds += 2 * costs['massSeconds'] * total
+    return seconds, max(peak, costs['massBytes'] * total)
+
+
+def planRun(args, header, costs=PLAN_COSTS, cores=None):
+    """
+    Estimate time and memory for each stage of plotElectrodeResponses from
+    its arguments and the recording header, and pick dtype, engine, chunk
+    size and learn workers that fit args.memLimit (GB) and args.timeBudget (s)
+    when they are given.
+    :param args: parsed plotElectrodeResponses arguments
+    :param header: (electrode labels, sample rate, number of samples)
+    :param costs: dict of per-operation costs (see PLAN_COSTS)
+    :param cores: CPU cores available to stump (default: all)
+    :return: dict with 'stages' [(name, seconds, bytes)], 'choices' and 'warnings'
+    """
+    from plotElectrodeResponses import getChannels, parseWindows
+    electLabels, sampleRate, sampleCount = header
+    cores = cores or os.cpu_count() or 1
+    allElect, goodChannels = getChannels(False, electLabels, args.channels, args.badChannels)
+    channels = len([c for c in goodChannels if c in electLabels])
+    m = args.eventDuration
+    windows = parseWindows(args.learnWindows) if args.learnWindows else []
+    if not windows:
+        windows = [(args.learnStart, args.learnStop)]
+    windowSamples = [int((stop - start) * sampleRate) for start, stop in windows]
+    findSamples = int((args.findStop - args.findStart) * sampleRate)
+    learn = args.pipeline in {'LEARN', 'ALL'}
+    find = args.pipeline in {'FIND', 'ALL'}
+    dynamic = args.dynamicWindow.upper() == 'YES' and len(windows) < 2
+    memLimit = args.memLimit * 1e9 if args.memLimit > 0 else np.inf
+    timeBudget = args.timeBudget if args.timeBudget > 0 else np.inf
+    choices = {'dtype': args.dtype, 'engine': args.engine,
+               'chunkSeconds': args.chunkSeconds, 'learnWorkers': args.learnWorkers}
+    warnings = []
+
+    def stages(choice):
+        itemsize = np.dtype(choice['dtype']).itemsize
+        data = len(electLabels) * sampleCount * itemsize
+        rows = [('read recording', costs['readSeconds'] * len(electLabels) * sampleCount, data)]
+        if args.screenChannels.upper() == 'YES':
+            rows.append(('screen channels', costs['screenSeconds'] * channels * sampleCount,
+                         channels * choice['chunkSeconds'] * sampleRate * 8 * 4))
+        if learn:
+            seconds, peak = learnCost(windowSamples, m, costs, cores, choice['learnWorkers'])
+            rows.append((f"learn ({'AB-join' if len(windows) > 1 else 'stump'}) "
+                         f"x{channels}", seconds * channels, peak))
+            if dynamic:
+                extSeconds, extPeak = 0, 0
+                for step in range(1, EXTEND_STEPS + 1):
+                    stepSeconds, stepPeak = learnCost(windowSamples, m + step * args.delta,
+                                                      costs, cores)
+                    extSeconds += stepSeconds
+                    extPeak = max(extPeak, stepPeak)
+                rows.append((f"extend window (~{EXTEND_STEPS} steps) x{channels}",
+                             extSeconds * channels, extPeak))
+        if find:
+            engine = choice['engine']
+            rows.append((f"find ({engine}) x{channels}",
+                         costs[f"{engine}Seconds"] * findSamples * channels,
+                         costs[f"{engine}Bytes"] * findSamples + channels * findSamples * itemsize))
+        if not allElect:
+            plotted = channels * (sum(windowSamples) * learn + findSamples * find)
+            figures = (2 * channels + 4) if channels > 1 else 6
+            rows.append((f"plots (~{figures} figures)", figures * costs['figureSeconds']
+                         + plotted * costs['plotSeconds'], 0))
+        if args.cleanOutput or args.exportEpochs:
+            rows.append(('clean/export', costs['readSeconds'] * len(electLabels) * sampleCount,
+                         len(electLabels) * choice['chunkSeconds'] * sampleRate * 8 * 3))
+        return rows
+
+    def peakBytes(rows):
+        # the recording stays loaded while each later stage runs
+        return rows[0][2] + max([row[2] for row in rows[1:]] + [0])
+
+    def totalSeconds(rows):
+        return sum(row[1] for row in rows)
+
+    if np.isfinite(memLimit):
+        if peakBytes(stages(choices)) > memLimit and choices['dtype'] == 'float64':
+            choices['dtype'] = 'float32'
+        for chunkSeconds in CHUNK_CHOICES:
+            choices['chunkSeconds'] = chunkSeconds
+            if len(electLabels) * chunkSeconds * sampleRate * 8 * 4 <= memLimit / 4:
+                break
+        if peakBytes(stages(choices)) > memLimit:
+            warnings.append(f"Estimated peak memory {peakBytes(stages(choices)) / 1e9:.1f}GB "
+                            f"exceeds --memLimit {args.memLimit:g}GB; select fewer channels "
+                            f"or a shorter learn window")
+    if (np.isfinite(memLimit) or np.isfinite(timeBudget)) and len(windows) > 1:
+        # as many AB-join processes as there are cores and memory for
+        perJoin = costs['stumpBytes'] * max(windowSamples)
+        spare = memLimit - stages(choices)[0][2]
+        choices['learnWorkers'] = int(max(1, min(cores, len(windows),
+                                                 spare // perJoin if np.isfinite(spare) else cores)))
+
+    if np.isfinite(timeBudget) and find:
+        # the most exact engine that fits; none fitting leaves the choice alone
+        for engine in ENGINE_ORDER[ENGINE_ORDER.index(args.engine):]:
+            if totalSeconds(stages(dict(choices, engine=engine))) <= timeBudget:
+                choices['engine'] = engine
+                break
+        if choices['engine'] != args.engine:
+            warnings.append(f"FIND uses the approximate '{choices['engine']}' engine to fit "
+                            f"--timeBudget {args.timeBudget:g}s")
+    if np.isfinite(timeBudget) and totalSeconds(stages(choices)) > timeBudget:
+        learnRows = [row for row in stages(choices) if row[0].startswith(('learn', 'extend'))]
+        warnings.append(f"Estimated {totalSeconds(stages(choices)):.0f}s exceeds --timeBudget "
+                        f"{args.timeBudget:g}s" +
+                        (f"; learning ({totalSeconds(learnRows):.0f}s) grows with the square "
+                         f"of the learn window, so shorten it or use fewer channels"
+                         if learnRows else ""))
+    rows = stages(choices)
+    return {'stages': rows, 'choices': choices, 'warnings': warnings,
+            'channels': channels, 'peakBytes': peakBytes(rows), 'seconds': totalSeconds(rows)}
+
+
+def formatSeconds(seconds):
+    if seconds >= 3600:
+        return f"{seconds / 3600:.1f}h"
+    if seconds >= 60:
+        return f"{seconds / 60:.1f}min"
+    return f"{seconds:.1f}s"
+
+
+def printPlan(plan):
+    print(f"Run plan for {plan['channels']} channel(s):")
+    print("Stage, time, memory")
+    for name, seconds, nBytes in plan['stages']:
+        print(f"{name}, {formatSeconds(seconds)}, {nBytes / 1e6:.0f}MB")
+    print(f"Total: {formatSeconds(plan['seconds'])}, peak memory "
+          f"{plan['peakBytes'] / 1e9:.2f}GB")
+    print(f"Chosen: {', '.join(f'{k}={v}' for k, v in plan['choices'].items())}")
+    for warning in plan['warnings']:
+        print(f"Warning: {warning}")
+
+
+def main(params):
+    """
+    print the plan for a plotElectrodeResponses command line
+    :param params: plotElectrodeResponses arguments, plus --calibrate to
+    measure the costs on this machine first
+    """
+    from plotElectrodeResponses import parse_args
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--calibrate', action='store_true')
+    own, rest = parser.parse_known_args(params)
+    args = parse_args(rest)
+    costs = calibrate() if own.calibrate else PLAN_COSTS
+    plan = planRun(args, readHeader(args.dataFile), costs=costs)
+    printPlan(plan)
+    return plan
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+from artifactRemoval import chunkBoundaries, cleanRecording
+
+
+def assertNoEventCut(bounds, starts, width, sampleCount):
+    assert bounds[0][0] == 0 and bounds[-1][1] == sampleCount
+    for (_, stop), (nextStart, _) in zip(bounds[:-1], bounds[1:]):
+        assert stop == nextStart
+    for start, stop in bounds:
+        assert stop > start
+        cut = [s for s in starts if s < stop < s + width]
+        assert not cut, f"chunk end {stop} cuts events {cut}"
+
+
+def test_chunkBoundaries_overlapping_events():
+    # the end is first pulled back to 1100, which still cuts the event at 1000
+    bounds = chunkBoundaries(np.array([1000, 1100]), 300, 5000, 1350)
+    assert bounds[0] == (0, 1000)
+    assertNoEventCut(bounds, [1000, 1100], 300, 5000)
+
+
+def test_chunkBoundaries_chunk_shorter_than_events():
+    starts = np.array([0, 250, 500, 2000])
+    bounds = chunkBoundaries(starts, 300, 4000, 100)
+    assertNoEventCut(bounds, starts, 300, 4000)
+
+
+def test_cleanRecording_overlapping_events(tmp_path):
+    rng = np.random.default_rng(0)
+    data = rng.normal(0, 1e-6, (2, 5000))
+    template = np.sin(np.linspace(0, np.pi, 300)) * 5e-5
+    starts = [np.array([1000, 1100]), np.array([1050])]
+    for row, rowStarts in enumerate(starts):
+        for s in rowStarts:
+            data[row, s:s + 300] += template
+    fName = str(tmp_path / 'clean.npy')
+    removed = cleanRecording(data, [template, template], starts, fName, [0, 1],
+                             sampleRate=1000, chunkSeconds=1.35)
+    assert removed == 3
+    cleaned = np.load(fName)
+    assert cleaned.shape == data.shape
+    assert np.max(np.abs(cleaned[1])) < np.max(np.abs(data[1])) / 5
+
+
+def test_cleanRecording_fif_matches_npy(tmp_path):
+    import mne
+    rng = np.random.default_rng(1)
+    data = rng.normal(0, 1e-5, (3, 4500))
+    info = mne.create_info(['E1', 'E2', 'E3'], 1000., 'eeg')
+    with info._unlock():
+        info['chs'][1]['cal'] = 2.5  # written values are divided by the calibration
+    template = np.sin(np.linspace(0, np.pi, 300)) * 5e-5
+    fName = str(tmp_path / 'clean_raw.fif')
+    cleanRecording(data, [template], [np.array([1000, 3000])], fName, [0],
+                   sampleRate=1000, chunkSeconds=1, info=info)
+    saved = mne.io.read_raw_fif(fName, preload=True, verbose='ERROR').get_data()
+    np.testing.assert_allclose(saved, np.load(str(tmp_path / 'clean_raw.npy')), atol=1e-12)
+
+
+def test_cleanRecording_fif_from_array_needs_info(tmp_path):
+    with pytest.raises(ValueError, match='info'):
+        cleanRecording(np.zeros((1, 1000)), [np.ones(10)], [np.array([100])],
+                       str(tmp_path / 'clean_raw.fif'), [0])
@@ -0,0 +1,199 @@
+import os
+import sys
+import subprocess
+import textwrap
+import numpy as np
+import pytest
+from blinkDection import (matchedFilterScale, matchedFilterProfile, hybridProfile,
+                          engineThreshold, combineDistanceProfiles, abJoin,
+                          findBlinkWaveMultiWindow, findBlinks, selectEvents,
+                          findConsensusBlinks, envelope, drawEventSpans, axisPixels)
+
+
+def events(n=5000, m=100, starts=(500, 2000, 3500), seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.normal(0, 0.05, n)
+    wave = np.sin(np.pi * np.arange(m) / m) ** 2
+    for start, size in zip(starts, [1.0, 0.3, 2.0]):
+        data[start:start + m] += size * wave
+    return wave, data
+
+
+def test_matchedFilterProfile_is_distance_like():
+    wave, data = events()
+    profile = matchedFilterProfile(wave, data)
+    assert np.all(profile >= 0) and np.all(profile <= 1)
+    # below the threshold exactly where the scale reaches minScale
+    scale = matchedFilterScale(wave, data)
+    np.testing.assert_array_equal(profile < engineThreshold('matched-filter', minScale=0.5),
+                                  scale > 0.5)
+
+
+def test_consensus_mean_caps_unscored_offsets():
+    wave, data = events()
+    profiles = [hybridProfile(wave, data), hybridProfile(wave, data[::-1].copy())]
+    assert np.isinf(profiles[0]).any()
+    consensus = combineDistanceProfiles(profiles, mode='MEAN', cap=2 * np.sqrt(len(wave)))
+    scored = np.isfinite(profiles[0]) | np.isfinite(profiles[1])
+    assert np.all(np.isfinite(consensus[scored]))
+    assert np.all(np.isinf(consensus[~scored]))
+    assert np.all(consensus[scored] <= 2 * np.sqrt(len(wave)))
+
+
+@pytest.mark.parametrize('engine', ['matched-filter', 'hybrid'])
+def test_no_candidates_selects_no_event(engine):
+    wave, _ = events()
+    noise = np.random.default_rng(3).normal(0, 0.05, 5000)
+    tLabels = np.arange(len(noise)) / 1000
+    blinks, dis, ixs = findBlinks(wave, noise, len(wave) / 1000, verbose=0, tLabels=tLabels,
+                                  engine=engine, minScale=0.5)
+    assert blinks == [] and dis == [] and ixs == []
+
+
+def test_no_candidates_mass_keeps_best_match():
+    # LEARN needs at least one event, so MASS still returns its best match
+    wave, _ = events()
+    noise = np.random.default_rng(3).normal(0, 0.05, 5000)
+    tLabels = np.arange(len(noise)) / 1000
+    blinks, dis, ixs = findBlinks(wave, noise, len(wave) / 1000, verbose=0, tLabels=tLabels,
+                                  engine='mass', disThresh=0.1)
+    assert len(ixs) == 1 and np.isfinite(dis[0])
+
+
+def test_selectEvents_never_selects_unscored_offsets():
+    assert selectEvents(np.full(100, np.inf), 10) == ([], [])
+    profile = np.full(100, np.inf)
+    profile[40] = 0.5
+    assert selectEvents(profile, 10, disThresh=1, tLabels=np.arange(100)) == ([40], [0.5])
+
+
+def test_consensus_mean_weights():
+    profiles = [np.array([1.0, 2.0, 3.0, 4.0]), np.array([3.0, 2.0, 1.0])]
+    # only the indices every channel has are kept
+    np.testing.assert_allclose(combineDistanceProfiles(profiles), [2.0, 2.0, 2.0])
+    np.testing.assert_allclose(combineDistanceProfiles(profiles, weights=[3, 1]),
+                               [1.5, 2.0, 2.5])
+
+
+def test_consensus_kofn_bounds():
+    profiles = [np.array([1.0, 5.0]), np.array([2.0, 6.0]), np.array([9.0, 4.0])]
+    np.testing.assert_array_equal(combineDistanceProfiles(profiles, mode='KOFN'), [2.0, 5.0])
+    np.testing.assert_array_equal(combineDistanceProfiles(profiles, mode='KOFN', k=1), [1.0, 4.0])
+    np.testing.assert_array_equal(combineDistanceProfiles(profiles, mode='KOFN', k=3), [9.0, 6.0])
+    # k is clamped to 1..n
+    np.testing.assert_array_equal(combineDistanceProfiles(profiles, mode='KOFN', k=0), [1.0, 4.0])
+    np.testing.assert_array_equal(combineDistanceProfiles(profiles, mode='KOFN', k=7), [9.0, 6.0])
+
+
+def test_consensus_events_need_k_channels():
+    # the events are on two of the three channels
+    wave, data = events()
+    noise = np.random.default_rng(5).normal(0, 0.05, len(data))
+    datas = [data, data + np.random.default_rng(6).normal(0, 0.02, len(data)), noise]
+    tLabels = np.arange(len(data)) / 1000
+    found = {}
+    for k in [2, 3]:
+        blinks, blinkDis, blinkIxs = findConsensusBlinks([wave] * 3, datas, len(wave) / 1000,
+                                                         tLabels=tLabels, verbose=0,
+                                                         mode='KOFN', k=k, disThresh=5)
+        # one set of events, with each channel's own dissimilarity at them
+        assert len(blinkDis) == 3 and all(len(dis) == len(blinkIxs) for dis in blinkDis)
+        assert blinks == [tLabels[ix] for ix in blinkIxs]
+        found[k] = blinkIxs
+    assert found[2] == [500, 2000, 3500]
+    assert len(found[3]) <= 1
+
+
+def windowsWithMotifs(m=100, seed=1):
+    # motif A recurs, distorted, in all four windows; motif B is an exact
+    # copy in only two of them
+    rng = np.random.default_rng(seed)
+    motifA = np.sin(np.pi * np.arange(m) / m) ** 2
+    motifB = np.linspace(-1, 1, m) ** 3
+    windows = [rng.normal(0, 0.3, 3000) for _ in range(4)]
+    for window in windows:
+        window[1000:1000 + m] += 3 * motifA + rng.normal(0, 0.5, m)
+    for window in windows[:2]:
+        window[2000:2000 + m] += 3 * motifB
+    return windows
+
+
+def test_abJoin_matches_brute_force():
+    rng = np.random.default_rng(0)
+    T_A, T_B, m = rng.normal(size=200), rng.normal(size=150), 20
+
+    def znorm(x):
+        return (x - x.mean()) / x.std()
+
+    subsB = np.array([znorm(T_B[j:j + m]) for j in range(len(T_B) - m + 1)])
+    dists, neighbors = abJoin((T_A, m, T_B))
+    for i in range(len(T_A) - m + 1):
+        brute = np.linalg.norm(subsB - znorm(T_A[i:i + m]), axis=1)
+        assert np.isclose(dists[i], brute.min(), atol=1e-6)
+        assert neighbors[i] == np.argmin(brute)
+
+
+def test_multiWindow_prefers_motif_in_most_windows():
+    _, members = findBlinkWaveMultiWindow(windowsWithMotifs(), 0.1, verbose=0, disThresh=6)
+    assert sorted(w for w, _ in members) == [0, 1, 2, 3]
+    assert all(950 <= ix <= 1050 for _, ix in members)
+
+
+def test_multiWindow_parallel_joins_exit(tmp_path):
+    # the pool must not inherit numba's threading state from a parent that
+    # already ran stump, or the interpreter hangs at exit
+    script = tmp_path / 'parallelJoins.py'
+    script.write_text(textwrap.dedent(f"""
+        import sys
+        sys.path[:0] = [{os.path.dirname(os.path.dirname(os.path.abspath(__file__)))!r},
+                        {os.path.dirname(os.path.abspath(__file__))!r}]
+        import stumpy
+        from jitCache import enableKernelCache
+        from blinkDection import findBlinkWaveMultiWindow
+        from test_blinkDection import windowsWithMotifs
+
+        if __name__ == '__main__':
+            enableKernelCache()
+            windows = windowsWithMotifs()
+            stumpy.stump(windows[0], 100)
+            serial = findBlinkWaveMultiWindow(windows, 0.1, verbose=0, disThresh=6)[1]
+            parallel = findBlinkWaveMultiWindow(windows, 0.1, verbose=0, disThresh=6,
+                                                workers=2)[1]
+            assert serial == parallel, (serial, parallel)
+            print('done')
+    """))
+    result = subprocess.run([sys.executable, str(script)], capture_output=True, text=True,
+                            timeout=600)
+    assert result.returncode == 0, result.stderr
+    assert 'done' in result.stdout
+
+
+def test_envelope_keeps_min_max_per_bin():
+    rng = np.random.default_rng(0)
+    yData = rng.normal(size=10050)
+    xData = np.arange(len(yData)) / 1000
+    xs, ys = envelope(xData, yData, 100)
+    binSize = int(np.ceil(len(yData) / 100))
+    assert len(xs) == len(ys) == 2 * int(np.ceil(len(yData) / binSize))
+    for b in range(len(ys) // 2):
+        block = yData[b * binSize:(b + 1) * binSize]
+        assert ys[2 * b] == block.min() and ys[2 * b + 1] == block.max()
+        assert xs[2 * b] == xs[2 * b + 1] == xData[b * binSize]
+    # short traces are drawn as they are
+    xs, ys = envelope(xData[:150], yData[:150], 100)
+    np.testing.assert_array_equal(ys, yData[:150])
+
+
+def test_drawEventSpans_one_collection():
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    fig = plt.figure(figsize=(4, 2), dpi=100)
+    ax = fig.add_axes([0, 0, 1, 1])
+    assert axisPixels(ax) == 400
+    spans = drawEventSpans(ax, [1.0, 5.0, 9.0], 0.3, -1, 2, ['r', 'g', 'b'])
+    assert list(ax.collections) == [spans] and not ax.patches
+    extents = [path.get_extents() for path in spans.get_paths()]
+    np.testing.assert_allclose([(e.x0, e.x1, e.y0, e.y1) for e in extents],
+                               [(1.0, 1.3, -1, 1), (5.0, 5.3, -1, 1), (9.0, 9.3, -1, 1)])
+    plt.close(fig)
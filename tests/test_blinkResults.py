@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+from blinkResults import EventSet
+
+
+def test_json_round_trip():
+    events = EventSet(blinkWave=np.ones(3), blinks=[1.5], blinksIndecies=[1500],
+                      dissimilarity=[2.0], duration=300)
+    restored = EventSet.fromJSON(events.toJSON(), dtype=np.float32)
+    assert restored.keys() == events.keys()
+    assert restored['blinkWave'].dtype == np.float32
+    assert restored['duration'] == 300
+
+
+def test_fromJSON_rejects_unknown_elements():
+    with pytest.raises(ValueError, match='blinkDis'):
+        EventSet.fromJSON({'blinkWave': [1.0], 'blinkDis': [2.0]})
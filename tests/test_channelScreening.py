@@ -0,0 +1,45 @@
+import numpy as np
+from channelScreening import screenChannels
+
+SAMPLE_RATE = 250
+LABELS = ['E1', 'E2', 'E3', 'E4', 'E5', 'E6', 'E7', 'E8']
+
+
+def recording(seconds=20, seed=0):
+    # rows 0-3 normal, 4 flat, 5 clipped, 6 mains hum, 7 very noisy
+    rng = np.random.default_rng(seed)
+    n = seconds * SAMPLE_RATE
+    data = rng.normal(0, 1e-5, (len(LABELS), n))
+    # row 0 also carries large blinks, which raise its variance
+    wave = np.sin(np.pi * np.arange(100) / 100) ** 2 * 1e-3
+    for start in range(200, n - 100, 400):
+        data[0, start:start + 100] += wave
+    data[4] = 3e-6
+    data[5, ::10] = 1e10
+    data[6] += 5e-5 * np.sin(2 * np.pi * 60 * np.arange(n) / SAMPLE_RATE)
+    data[7] *= 30
+    return data
+
+
+def test_screenChannels_reasons():
+    kept, failures = screenChannels(recording(), range(len(LABELS)), LABELS,
+                                    sampleRate=SAMPLE_RATE, chunkSeconds=3, targets=[0])
+    assert kept == [0, 1, 2, 3]
+    assert sorted(failures) == [4, 5, 6, 7]
+    assert any(r.startswith('flat') for r in failures[4])
+    assert any('samples over' in r for r in failures[5])
+    assert any('Hz' in r for r in failures[6])
+    assert any('variance' in r and 'over' in r for r in failures[7])
+
+
+def test_screenChannels_judges_target_variance_only_from_below(capsys):
+    data = recording()
+    _, failures = screenChannels(data, range(len(LABELS)), LABELS,
+                                 sampleRate=SAMPLE_RATE, chunkSeconds=3)
+    assert any('variance' in r for r in failures[0])
+    # a flat target is still dropped, with a warning
+    data[0] = 0
+    kept, failures = screenChannels(data, range(len(LABELS)), LABELS,
+                                    sampleRate=SAMPLE_RATE, chunkSeconds=3, targets=[0])
+    assert 0 not in kept
+    assert 'target channel E1' in capsys.readouterr().out
@@ -0,0 +1,46 @@
+import numpy as np
+import dtypeAccuracy
+from dtypeAccuracy import compareDtypes, matchedFraction
+
+SAMPLE_RATE = 1000
+
+
+def recording(seconds=30, seed=0):
+    rng = np.random.default_rng(seed)
+    n = seconds * SAMPLE_RATE
+    data = rng.normal(0, 2e-6, (2, n))
+    wave = np.sin(np.pi * np.arange(200) / 200) ** 2 * 5e-5
+    for start in range(500, n - 200, 1700):
+        data[:, start:start + 200] += wave * rng.uniform(0.8, 1.2)
+    return data, np.arange(n) / SAMPLE_RATE
+
+
+def test_matchedFraction():
+    assert matchedFraction(np.array([100, 500, 900]), np.array([101, 898]), 2) == 2 / 3
+    assert matchedFraction(np.array([100]), np.array([103]), 2) == 0
+    assert matchedFraction(np.array([]), np.array([]), 2) == 1
+    assert matchedFraction(np.array([100]), np.array([]), 2) == 0
+
+
+def test_float32_agrees_on_clean_events(capsys):
+    data, tLabels = recording()
+    assert compareDtypes(data, tLabels, [0, 1], ['E1', 'E2'], 200, SAMPLE_RATE,
+                         (0, 15), (15, 30))
+    assert 'float32 results match float64' in capsys.readouterr().out
+
+
+def test_report_flags_divergence(monkeypatch, capsys):
+    data, tLabels = recording()
+    runChannel = dtypeAccuracy.runChannel
+
+    def shiftedFloat32(channel, *args):
+        # a float32 path whose events land a few samples off
+        wave, ixs, dis = runChannel(channel, *args)
+        return (wave, ixs + 5, dis) if channel.dtype == np.float32 else (wave, ixs, dis)
+
+    monkeypatch.setattr(dtypeAccuracy, 'runChannel', shiftedFloat32)
+    assert not compareDtypes(data, tLabels, [0], ['E1', 'E2'], 200, SAMPLE_RATE,
+                             (0, 15), (15, 30))
+    out = capsys.readouterr().out
+    assert 'float32 results DIFFER from float64' in out
+    assert 'E1, ' in out and ', 0.0, ' in out
@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+from epochExport import exportEpochs, openEpochs
+
+
+def test_exportEpochs_pads_with_nan(tmp_path):
+    data = np.arange(20, dtype=np.float64).reshape(2, 10)
+    fName = str(tmp_path / 'epochs.npy')
+    assert exportEpochs(data, [0, 1], [1, 8], 2, 3, fName, dtype=np.float32) == (2, 2, 5)
+    epochs, metadata = openEpochs(fName)
+    assert metadata['dtype'] == 'float32'
+    np.testing.assert_array_equal(epochs[0, 1], [np.nan, 10, 11, 12, 13])
+    np.testing.assert_array_equal(epochs[1, 0], [6, 7, 8, 9, np.nan])
+
+
+def test_exportEpochs_rejects_integer_dtype(tmp_path):
+    with pytest.raises(ValueError, match='NaN'):
+        exportEpochs(np.zeros((1, 10)), [0], [2], 0, 3, str(tmp_path / 'epochs.npy'),
+                     dtype=np.int16)
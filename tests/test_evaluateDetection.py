@@ -0,0 +1,44 @@
+import time
+import tracemalloc
+import numpy as np
+import evaluateDetection
+from evaluateDetection import accepted, scoreEvents, evaluate
+
+
+def metrics(precision, recall, onsetErrorMs):
+    return {'precision': precision, 'recall': recall, 'onsetErrorMs': onsetErrorMs}
+
+
+def test_accepted_within_tolerance():
+    assert accepted(metrics(0.9, 0.8, 10), metrics(0.89, 0.79, 12)) == (True, [])
+    assert accepted(metrics(0.9, 0.8, 10), metrics(0.85, 0.8, 10)) == (False, [])
+
+
+def test_accepted_skips_metrics_missing_from_baseline():
+    # a baseline without detections has no precision or onset error
+    baseline = scoreEvents(np.array([1.0, 2.0]), np.array([]), 0.15)
+    candidate = scoreEvents(np.array([1.0, 2.0]), np.array([1.01]), 0.15)
+    ok, notComparable = accepted(baseline, candidate)
+    assert ok
+    assert notComparable == ['precision', 'onsetErrorMs']
+
+
+def test_accepted_rejects_candidate_losing_a_metric():
+    assert not accepted(metrics(0.9, 0.8, 10), metrics(np.nan, 0.8, 10))[0]
+
+
+def test_evaluate_times_a_warm_run(monkeypatch):
+    # the first run of a configuration pays the first-call costs; it must be
+    # the traced one, not the timed one
+    calls = []
+
+    def runConfiguration(*args):
+        calls.append(tracemalloc.is_tracing())
+        if len(calls) == 1:
+            time.sleep(0.5)
+        return [[1.0, 2.0]]
+
+    monkeypatch.setattr(evaluateDetection, 'runConfiguration', runConfiguration)
+    pooled, _ = evaluate(None, None, [0], ['E1'], {}, np.array([1.0, 2.0]), 1000, (0, 10))
+    assert calls == [True, False]
+    assert pooled['runtime'] < 0.5 and pooled['recall'] == 1
@@ -0,0 +1,60 @@
+import os
+import numpy as np
+import pytest
+from blinkDection import DETECTION_ENGINES, zeroOutOfRange
+from findSession import FindSession
+
+
+def recording(n=8000, m=150, seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.normal(0, 2e-6, n)
+    wave = np.sin(np.pi * np.arange(m) / m) ** 2 * 5e-5
+    # events on, next to and across the seams at 3000 and 5000
+    for start in [1200, 2900, 2990, 4000, 4920, 6500]:
+        data[start:start + m] += wave * rng.uniform(0.5, 1.5)
+    return data, wave
+
+
+@pytest.fixture
+def recordingFile(tmp_path):
+    fName = tmp_path / 'recording.set'
+    fName.write_bytes(b'0' * 100)
+    return str(fName)
+
+
+@pytest.mark.parametrize('engine', ['mass', 'matched-filter', 'hybrid'])
+def test_grown_range_matches_cold_run(tmp_path, recordingFile, engine):
+    data, wave = recording()
+    session = FindSession(str(tmp_path / 'session.npz'), recordingFile)
+    session.distanceProfile(3, wave, data, 3000, 5000, engine=engine)
+    session.save()
+    # a new process reads the stored profile and grows it on both sides
+    session = FindSession(str(tmp_path / 'session.npz'), recordingFile)
+    grown = session.distanceProfile(3, wave, data, 1000, 7000, engine=engine)
+    cold = DETECTION_ENGINES[engine](wave, zeroOutOfRange(data[1000:7000]), minScale=0.5)
+    assert session.reused == 5000 - len(wave) + 1 - 3000
+    np.testing.assert_allclose(grown, cold, rtol=1e-9, atol=1e-9)
+    # a range inside the stored one computes nothing
+    computed = session.computed
+    np.testing.assert_allclose(session.distanceProfile(3, wave, data, 2000, 6000, engine=engine),
+                               cold[1000:6000 - len(wave) + 1 - 1000], rtol=1e-9, atol=1e-9)
+    assert session.computed == computed
+
+
+@pytest.mark.parametrize('change', ['mtime', 'size'])
+def test_changed_recording_discards_session(tmp_path, recordingFile, change):
+    data, wave = recording()
+    sessionName = str(tmp_path / 'session.npz')
+    session = FindSession(sessionName, recordingFile)
+    session.distanceProfile(3, wave, data, 3000, 5000)
+    session.save()
+    assert FindSession(sessionName, recordingFile).entries
+    stat = os.stat(recordingFile)
+    if change == 'mtime':
+        os.utime(recordingFile, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    else:
+        with open(recordingFile, 'ab') as f:
+            f.write(b'0')
+        # same modification time, so only the size tells them apart
+        os.utime(recordingFile, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    assert FindSession(sessionName, recordingFile).entries == {}
@@ -0,0 +1,36 @@
+import os
+import sys
+import subprocess
+import jitCache
+from jitCache import secondsSinceStart
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cachedKernels(cacheDir):
+    return {os.path.join(path, name): os.stat(os.path.join(path, name)).st_mtime_ns
+            for path, _, names in os.walk(cacheDir) for name in names}
+
+
+def test_warmUp_fills_cache_once(tmp_path):
+    # each run is a fresh process, as in the pipeline; the second one must
+    # load every kernel the first compiled instead of compiling it again
+    cacheDir = str(tmp_path / 'numba')
+    command = [sys.executable, jitCache.__file__, '--cacheDir', cacheDir, '--eventDuration', '20']
+    first = subprocess.run(command, capture_output=True, text=True, cwd=ROOT, timeout=600)
+    assert first.returncode == 0, first.stderr
+    compiled = cachedKernels(cacheDir)
+    assert any(name.endswith('.nbc') for name in compiled)
+    second = subprocess.run(command, capture_output=True, text=True, cwd=ROOT, timeout=600)
+    assert second.returncode == 0, second.stderr
+    assert cachedKernels(cacheDir) == compiled
+    assert 'Time from process start' in second.stdout
+
+
+def test_secondsSinceStart_counts_from_process_start():
+    elapsed = secondsSinceStart()
+    assert 0 < elapsed <= secondsSinceStart()
+    fresh = subprocess.run([sys.executable, '-c', 'from jitCache import secondsSinceStart; '
+                            'print(secondsSinceStart())'],
+                           capture_output=True, text=True, cwd=ROOT, timeout=120)
+    assert 0 < float(fresh.stdout) < 60
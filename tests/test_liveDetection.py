@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from blinkDection import findBlinks, zeroOutOfRange
+from liveDetection import StreamDetector
+
+M = 300
+
+
+def synthetic(n=20000, seed=0):
+    # events closer than a width (competing flanks), between one and two
+    # widths apart, and one ending a few samples before the stream does
+    starts = [1000, 1150, 3000, 3450, 6000, 6200, 6400, 9000, 12000, 12600, n - M - 5]
+    rng = np.random.default_rng(seed)
+    data = rng.normal(0, 2e-6, (2, n))
+    wave = np.sin(np.pi * np.arange(M) / M) ** 2 * 5e-5
+    for start in starts:
+        data[:, start:start + M] += wave
+    return data, wave
+
+
+def streamEvents(detector, data, blockSize):
+    events = []
+    for start in range(0, data.shape[1], blockSize):
+        events.extend(detector.process(start, data[:, start:start + blockSize]))
+    events.extend(detector.flush())
+    return events
+
+
+@pytest.mark.parametrize('blockSize', [1, 97, 300, 1000, 20000])
+def test_stream_matches_findBlinks(blockSize):
+    data, wave = synthetic()
+    detector = StreamDetector([wave, wave], [0, 1], ['E1', 'E2'])
+    events = streamEvents(detector, data.astype(np.float32), blockSize)
+    for row, label in enumerate(['E1', 'E2']):
+        vData = zeroOutOfRange(data[row].astype(np.float32).astype(np.float64))
+        _, batchDis, batchIxs = findBlinks(wave, vData, M / 1000, verbose=0,
+                                           tLabels=np.arange(len(vData)) / 1000)
+        found = [e for e in events if e['electrode'] == label]
+        assert [e['sample'] for e in found] == batchIxs
+        np.testing.assert_allclose([e['dissimilarity'] for e in found], batchDis, atol=1e-6)
+
+
+def test_block_without_template_row():
+    detector = StreamDetector([np.ones(M)], [13], ['E14'])
+    with pytest.raises(ValueError, match='channelMap'):
+        detector.process(0, np.zeros((1, 1000), dtype=np.float32))
@@ -0,0 +1,46 @@
+import numpy as np
+from jitCache import DEFAULT_CACHE_DIR
+from parameterSweep import buildTasks, sweep, summarize, _initWorker, runTask
+
+SAMPLE_RATE = 1000
+
+
+def recording(seconds=24, seed=0):
+    rng = np.random.default_rng(seed)
+    n = seconds * SAMPLE_RATE
+    data = rng.normal(0, 2e-6, (2, n))
+    wave = np.sin(np.pi * np.arange(200) / 200) ** 2 * 5e-5
+    for start in range(500, n - 200, 1300):
+        data[:, start:start + 200] += wave * rng.uniform(0.8, 1.2)
+    return data, np.arange(n) / SAMPLE_RATE
+
+
+GRID = {'eventDuration': [200], 'disThresh': [3, 10], 'delta': [0],
+        'learnWindow': ['2-12']}
+
+
+def test_buildTasks_groups_configs_per_setup():
+    grid = dict(GRID, eventDuration=[200, 300])
+    tasks = buildTasks(grid, [0, 1], ['E1', 'E2'])
+    assert [setup for setup, _ in tasks] == [(0, 'E1', 200, '2-12'), (1, 'E2', 200, '2-12'),
+                                             (0, 'E1', 300, '2-12'), (1, 'E2', 300, '2-12')]
+    for (_, _, eventDuration, _), configs in tasks:
+        assert len(configs) == 2
+        assert all(config['eventDuration'] == eventDuration for config in configs)
+
+
+def test_sweep_matches_in_process_run(capsys):
+    data, tLabels = recording()
+    table, setupTable = sweep(data, tLabels, [0, 1], ['E1', 'E2'], GRID, SAMPLE_RATE,
+                              12, 24, workers=2)
+    _initWorker(data, tLabels, SAMPLE_RATE, (12, 24), DEFAULT_CACHE_DIR)
+    results = [res for task in buildTasks(GRID, [0, 1], ['E1', 'E2'])
+               for res in runTask(task)[1]]
+    expected = summarize(results, 12)
+    assert len(table) == 2 and [row['channels'] for row in setupTable] == [2]
+    for row, expectedRow in zip(table, expected):
+        assert row['events'] == expectedRow['events'] > 0
+        assert np.isclose(row['meanDissimilarity'], expectedRow['meanDissimilarity'])
+    # the pipeline's output stays out of the table, without leaving stdout redirected
+    print('visible')
+    assert 'visible' in capsys.readouterr().out
@@ -0,0 +1,52 @@
+import numpy as np
+from plotElectrodeResponses import parse_args
+from resourcePlanner import planRun, learnCost, calibrate, PLAN_COSTS
+
+# ten minutes of a 129 channel recording at 1000Hz
+HEADER = ([f"E{ix}" for ix in range(1, 130)], 1000, 600 * 1000)
+
+
+def plan(*params):
+    return planRun(parse_args(['--channels', '14 8 1', '--findStart', '0', '--findStop', '600']
+                              + list(params)), HEADER, cores=4)
+
+
+def test_learnCost_grows_with_square_of_window():
+    costs = dict(PLAN_COSTS, massSeconds=0)
+    short, _ = learnCost([10000], 300, costs, cores=4)
+    long, _ = learnCost([20000], 300, costs, cores=4)
+    assert np.isclose(long / short, ((20000 - 299) / (10000 - 299)) ** 2)
+    # the AB-joins of three windows cover every pair in both directions
+    joins, _ = learnCost([10000, 10000, 10000], 300, costs, cores=4)
+    assert np.isclose(joins, costs['stumpSeconds'] * 6 * 10000 ** 2 / 4)
+
+
+def test_memLimit_picks_float32_and_smaller_chunks():
+    free = plan()
+    assert free['choices']['dtype'] == 'float64' and free['warnings'] == []
+    assert free['choices']['chunkSeconds'] == 60
+    # the float64 recording alone (619MB) is over the limit, float32 is not
+    limited = plan('--memLimit', '0.5')
+    assert limited['choices']['dtype'] == 'float32'
+    assert limited['choices']['chunkSeconds'] == 30
+    assert limited['peakBytes'] <= 0.5e9 and limited['warnings'] == []
+    # not even float32 fits: keep float32 and say so
+    tight = plan('--memLimit', '0.2')
+    assert tight['choices']['dtype'] == 'float32'
+    assert any('exceeds --memLimit' in warning for warning in tight['warnings'])
+
+
+def test_timeBudget_picks_approximate_engine():
+    exact = plan('--pipeline', 'FIND')
+    findSeconds = [seconds for name, seconds, _ in exact['stages'] if name.startswith('find')][0]
+    budget = exact['seconds'] - findSeconds / 2
+    fast = plan('--pipeline', 'FIND', '--timeBudget', f"{budget}")
+    assert fast['choices']['engine'] != 'mass' and fast['seconds'] <= budget
+    assert any('approximate' in warning for warning in fast['warnings'])
+
+
+def test_calibrate_measures_every_cost():
+    costs = calibrate(m=50)
+    for key in ['stumpSeconds', 'massSeconds', 'matched-filterSeconds', 'hybridSeconds']:
+        assert costs[key] > 0
+    assert costs['readSeconds'] == PLAN_COSTS['readSeconds']